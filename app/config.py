@@ -7,8 +7,86 @@ QB_PASS = "YanGxinXINx98Z5~"
 # qBittorrent Processing Settings
 QB_SIMILARITY_THRESHOLD = 90
 QB_EXCLUDE_CATEGORIES = ["刷流"]  # Categories to exclude from processing
+QB_FETCH_MODE = "async"  # "async": 并发获取各种子的文件列表，找到匹配即取消其余请求; "sequential": 逐个获取
+QB_FETCH_CONCURRENCY = 8  # async 模式下同时进行的请求数（也是长连接池大小）
+
+# MoviePilot Settings
+MP_ENABLED = True
+
+# Delete Integrations (删除联动插件)
+# mode: "sync" 等待完成 / "async" 后台线程池 / "batch" 按窗口合并
+# concurrency: 插件线程池大小; timeout: 秒; batch_window / batch_size 仅 batch 模式使用
+INTEGRATIONS = {
+    "moviepilot": {"mode": "sync", "concurrency": 1, "timeout": 120},
+    "qbittorrent": {"mode": "sync", "concurrency": 1, "timeout": 300},
+}
 
 # File System Paths
 MEDIA_PATH = "~/Media/plex"    # 要监听的媒体文件路径
 SOURCE_PATH = "~/Media/source"  # 源文件路径
 DB_PATH = "~/Media/file_links.db"  # SQLite 数据库存储位置
+
+# SQLite Tuning & Maintenance (数据库调优与维护)
+DB_CACHE_SIZE_KB = 64 * 1024    # 每个连接的页缓存（KB）
+DB_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取的上限（字节），0 关闭
+DB_PAGE_SIZE = 4096             # 仅对新建数据库生效（已有库需 --vacuum 重建）
+DB_CHECKPOINT_IDLE = 5          # 秒；无写入超过该时间后做一次 PASSIVE 检查点
+DB_TRUNCATE_AFTER_ROWS = 10000  # 累计写入超过该行数（大批量）后做 TRUNCATE 检查点，收缩 WAL 文件
+DB_VACUUM_FREELIST_PCT = 10     # 空闲页超过总页数该比例时做增量 vacuum
+DB_VACUUM_PAGES = 2000          # 每次增量 vacuum 释放的页数上限
+DB_MAINT_INTERVAL = 60          # 秒；检查空闲页与输出 WAL 状态的间隔
+
+# Event Journal (事件预写日志)
+JOURNAL_ENABLED = True          # 记录已接收的监听事件；重启时只重放未处理的部分，不再全量扫描
+JOURNAL_PATH = None             # None 表示 <DB_PATH>.events
+JOURNAL_FSYNC_INTERVAL = 0.1    # 秒；后台线程合并 fsync 的间隔
+JOURNAL_FSYNC_BATCH = 256       # 累积多少条未落盘事件时立即 fsync
+JOURNAL_CHECKPOINT_INTERVAL = 5  # 秒；写入检查点（已处理低水位）的间隔
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024  # 日志超过该大小时在检查点后压缩
+
+# Scan Filters (扫描 / 监听 / 分类共用的过滤规则)
+SCAN_PRUNE_DIRS = ["@eaDir", "#recycle", "#snapshot", ".@__thumb", ".Trash-*", "$RECYCLE.BIN",
+                   "System Volume Information", ".AppleDouble"]  # 目录名（可用 glob），命中则整棵子树跳过
+SCAN_EXCLUDE_GLOBS = [".DS_Store", "._*", "Thumbs.db", "desktop.ini", "*.!qB", "*.partial", "*.part"]  # 文件名 glob
+SCAN_EXCLUDE_EXTS = []   # 例如 [".nfo", ".jpg"]
+SCAN_INCLUDE_EXTS = []   # 非空时只索引这些扩展名，例如 [".mkv", ".mp4"]
+SCAN_MIN_SIZE = 0        # 字节；小于该大小的文件不入库
+
+# I/O Throttling (扫描 / 巡检的磁盘 I/O 调度，按设备 st_dev 计)
+IO_STAT_PER_SEC = 0        # 每个设备每秒 stat 次数上限，0 表示不限
+IO_DIR_PER_SEC = 0         # 每个设备每秒读取目录次数上限，0 表示不限
+IO_DEVICE_BUDGETS = {}     # 按设备覆盖：{"/mnt/hdd1": (200, 20)} 或 {st_dev: (stat/s, dir/s)}
+IO_ADAPTIVE = True         # stat 延迟升高（磁盘被播放/做种占用）时自动退让
+IO_LATENCY_TARGET_MS = 50  # 延迟 EWMA 超过该值开始退让
+IO_MIN_FACTOR = 0.05       # 退让下限：最少占用约 5% 的设备时间
+IO_SCAN_IDLE = False       # 全量扫描线程使用 ioprio IDLE 类（仅 Linux）
+IO_SCAN_NICE = None        # 全量扫描线程的 nice 值，None 表示不调整
+IO_SWEEP_IDLE = True       # 巡检线程使用 ioprio IDLE 类
+
+# Sharding (多进程分片)
+SHARDS = 1  # >1 时按磁盘把根目录分配到多个进程扫描/监听，结果汇总到单一写入线程
+
+# Watch Workers (监听事件处理)
+WATCH_WORKERS = 4  # 按路径哈希分发事件的 worker 数；同一路径的事件保持顺序，1 表示单线程
+
+# Delete Batching (删除事件合并)
+DELETE_BATCH_WINDOW = 0.5  # 秒；收到删除事件后等待该时间合并后续删除，0 表示逐个处理
+DELETE_BATCH_MAX = 500     # 单批最多合并的删除数
+
+# In-memory Index (内存镜像，约 300 字节/文件)
+MEMINDEX_ENABLED = False
+
+# Integrity Sweeper (后台巡检，修复事件丢失导致的索引漂移)
+SWEEP_ENABLED = True
+SWEEP_FILES_PER_SEC = 20   # 每秒最多 stat 的文件数
+SWEEP_IO_PCT = None        # 例如 5 表示巡检 I/O 时间不超过 5%；None 表示不限制
+SWEEP_PERIOD_HOURS = 24    # 每轮巡检覆盖整个索引的周期
+SWEEP_CHUNK_SIZE = 200     # 每次从数据库读取的路径数
+
+# Profiling (性能剖析，默认关闭；--profile 临时开启)
+PROFILE_ENABLED = False
+PROFILE_DUMP_INTERVAL = 300      # 秒，定期输出各阶段耗时直方图；SIGUSR1 立即输出
+PROFILE_SAMPLE = None            # None / "cprofile" / "tracemalloc"；SIGUSR2 触发采样窗口
+PROFILE_SAMPLE_WINDOW = 30       # 采样窗口长度（秒）
+PROFILE_SAMPLE_EVERY = 0         # >0 时每隔该秒数自动采样一次
+PROFILE_DIR = "~/Media/profiles" # 采样结果输出目录
@@ -1,25 +1,74 @@
+import functools
 import os
 import sqlite3
+import threading
 from contextlib import contextmanager
-from typing import Optional, Iterable, Dict, Any, Tuple
+from typing import Optional, Iterable, Dict, Any, List, Tuple
 from datetime import datetime
-from qb import get_torrent_hash_from_file
-from qb import get_filename_from_path
-from config import QB_ENABLED
-from moviepilot import cleanup_transfer_task
+from integrations import IntegrationRegistry, build_default_registry
+from integrations import HOOK_MEDIA_DELETE, HOOK_SOURCE_DELETE
+from memindex import PathIndex
+from config import DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_PAGE_SIZE, SCAN_MIN_SIZE
+import profiling
+
+SQL_BATCH = 500  # 单条语句的参数上限（SQLite 旧版本默认 999）
+
+UPSERT_SQL = """
+    INSERT INTO files(dev, ino, path, category, size, mtime, mtime_readable)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dev, ino, path) DO UPDATE SET
+        category=excluded.category,
+        size=excluded.size,
+        mtime=excluded.mtime,
+        mtime_readable=excluded.mtime_readable
+"""
+
+def _locked(fn):
+    # 共享连接上的 SQL 串行执行；RLock 允许在 tx() 内嵌套调用
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+_STALE = object()  # _prior_state：同一路径存在多行，必须重写
+
 
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, integrations: Optional[IntegrationRegistry] = None,
+                 index: Optional[PathIndex] = None):
+        # 删除联动插件；传入空注册表即可关闭所有外部调用
+        self.integrations = integrations if integrations is not None else build_default_registry()
+        self.db_path = db_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # 多个 worker 共用一个连接：所有 SQL 与事务持有该锁，插件调用与删文件不持锁
+        self._lock = threading.RLock()
+        self.upserts_written = 0
+        self.upserts_skipped = 0  # 状态未变而跳过的写入
+        # 与扫描的 SCAN_MIN_SIZE 一致：监听事件同样不收录过小的文件
+        self.min_size = SCAN_MIN_SIZE
         self.conn.row_factory = sqlite3.Row
         self._init_pragmas()
         self.init_schema()
+        # 可选的内存镜像：所有写操作同步更新，读操作优先走内存
+        self.index = index
+        if index is not None and not len(index):
+            index.load(self.conn)
 
     def _init_pragmas(self):
         cur = self.conn.cursor()
+        if cur.execute("PRAGMA page_count;").fetchone()[0] == 0:
+            # 新库：页大小与增量 vacuum 只能在建表前（或 VACUUM 时）设定
+            cur.execute(f"PRAGMA page_size={int(DB_PAGE_SIZE)};")
+            cur.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        cur.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)};")
+        cur.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)};")
         cur.execute("PRAGMA journal_mode=WAL;")
         cur.execute("PRAGMA synchronous=NORMAL;")
         cur.execute("PRAGMA foreign_keys=ON;")
+        if cur.execute("PRAGMA auto_vacuum;").fetchone()[0] == 0:
+            print("[DB] auto_vacuum is off for this database; run once with --vacuum to enable incremental vacuum")
         cur.close()
 
     def init_schema(self):
@@ -38,53 +87,211 @@ class Database:
         """)
         cur.execute("CREATE INDEX IF NOT EXISTS idx_files_devino ON files(dev, ino);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_files_path ON files(path);")
+        # 后台任务的持久化状态（如巡检游标）
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """)
         cur.close()
 
+    @_locked
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    @_locked
+    def set_meta(self, key: str, value: str):
+        self.conn.execute(
+            "INSERT INTO meta(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, value))
+
     @contextmanager
-    def tx(self):
-        try:
-            self.conn.execute("BEGIN;")
-            yield
-            self.conn.execute("COMMIT;")
-        except Exception:
-            self.conn.execute("ROLLBACK;")
-            raise
+    def tx(self, rollback_paths: Optional[Iterable[str]] = None):
+        """整个事务持锁，其它线程的写入不会混入。
+
+        回滚后内存镜像可能已偏离：默认整体重新加载；共享镜像的其它连接（巡检）应传入
+        rollback_paths，只按本连接的数据恢复这些路径，避免覆盖主连接正在进行的写入。
+        """
+        with self._lock:
+            try:
+                self.conn.execute("BEGIN;")
+                yield
+                self.conn.execute("COMMIT;")
+            except Exception:
+                self.conn.execute("ROLLBACK;")
+                if self.index is not None:
+                    if rollback_paths is None:
+                        self.index.load(self.conn)
+                    else:
+                        self.reload_index_paths(rollback_paths)
+                raise
+
+    @_locked
+    def reload_index_paths(self, paths: Iterable[str]):
+        # 按数据库中已提交的记录恢复指定路径的内存镜像
+        for path in paths:
+            self.index.remove(path)
+            for r in self.conn.execute(
+                    "SELECT path, dev, ino, category, size, mtime FROM files WHERE path = ?", (path,)):
+                self.index.add(r["path"], r["category"], r["dev"], r["ino"], r["size"], r["mtime"])
 
     def row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
         return dict(row) if row else {}
 
     def upsert_from_stat(self, path: str, category: str):
-        st = os.stat(path, follow_symlinks=False)
-        dev, ino, size, mtime = st.st_dev, st.st_ino, st.st_size, st.st_mtime
+        with profiling.stage("stat"):
+            st = os.stat(path, follow_symlinks=False)
+        if st.st_size < self.min_size:
+            # 文件可能由大变小，已有记录一并删除
+            self.delete_by_path(path)
+            return
+        return self.upsert_row(path, category, st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def _prior_state(self, path: str):
+        # 路径当前在库中的 (dev, ino, size, mtime, category)；有内存镜像时不访问 SQLite。
+        # 不做进程内 LRU：巡检线程经独立连接写库，缓存会与数据库不一致
+        if self.index is not None:
+            rec = self.index.get(path)
+            return (rec.dev, rec.ino, rec.size, rec.mtime, rec.category) if rec else None
+        rows = self.conn.execute(
+            "SELECT dev, ino, size, mtime, category FROM files WHERE path = ? LIMIT 2", (path,)).fetchall()
+        if len(rows) != 1:
+            # 无记录，或残留了旧 inode 的行（需要重写）
+            return _STALE if rows else None
+        return tuple(rows[0])
+
+    @_locked
+    def upsert_row(self, path: str, category: str, dev: int, ino: int, size: int, mtime: float):
+        with profiling.stage("sql.prior"):
+            prior = self._prior_state(path)
+        if prior == (dev, ino, size, mtime, category):
+            # size / mtime / inode 均未变化：跳过写入，不产生 WAL
+            self.upserts_skipped += 1
+            return (dev, ino)
+        if prior is _STALE or (prior is not None and prior[:2] != (dev, ino)):
+            # 文件被替换（inode 变化），先删除旧行，避免同一路径残留两行
+            self.delete_by_path(path)
+
         mtime_readable = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-        
-        cur = self.conn.cursor()
-        # 如果已经存在同 dev,ino,但 path 不同，允许并存（硬链接）
-        cur.execute("""
-            INSERT INTO files(dev, ino, path, category, size, mtime, mtime_readable)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(dev, ino, path) DO UPDATE SET
-                category=excluded.category,
-                size=excluded.size,
-                mtime=excluded.mtime,
-                mtime_readable=excluded.mtime_readable
-        """, (dev, ino, path, category, size, mtime, mtime_readable))
-        cur.close()
+        with profiling.stage("sql.upsert"):
+            cur = self.conn.cursor()
+            # 如果已经存在同 dev,ino,但 path 不同，允许并存（硬链接）
+            cur.execute(UPSERT_SQL, (dev, ino, path, category, size, mtime, mtime_readable))
+            cur.close()
+        self.upserts_written += 1
+        if self.index is not None:
+            self.index.add(path, category, dev, ino, size, mtime)
         return (dev, ino)
 
+    @_locked
+    def upsert_rows(self, rows: Iterable[Tuple[str, str, int, int, int, float]]):
+        # 批量写入预先 stat 好的记录：(path, category, dev, ino, size, mtime)；未变化的行跳过
+        params = []
+        for path, category, dev, ino, size, mtime in rows:
+            prior = self._prior_state(path)
+            if prior == (dev, ino, size, mtime, category):
+                self.upserts_skipped += 1
+                continue
+            if prior is _STALE or (prior is not None and prior[:2] != (dev, ino)):
+                self.delete_by_path(path)
+            params.append((dev, ino, path, category, size, mtime,
+                           datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')))
+        if params:
+            self.conn.executemany(UPSERT_SQL, params)
+        self.upserts_written += len(params)
+        if self.index is not None:
+            for dev, ino, path, category, size, mtime, _ in params:
+                self.index.add(path, category, dev, ino, size, mtime)
+        return len(params)
+
+    def upsert_stats(self) -> Dict[str, Any]:
+        written, skipped = self.upserts_written, self.upserts_skipped
+        total = written + skipped
+        return {"written": written, "skipped": skipped,
+                "skipped_pct": round(skipped * 100.0 / total, 1) if total else 0.0}
+
+    # 全量扫描的标记-清除：扫描期间记录见到的路径，结束时删除未见到的行，
+    # 代替 clear_all + 全部重写（未变化的行不再产生 WAL）
+    @_locked
+    def begin_scan(self):
+        self.conn.execute("DROP TABLE IF EXISTS temp.scan_seen;")
+        self.conn.execute("CREATE TEMP TABLE scan_seen (path TEXT PRIMARY KEY) WITHOUT ROWID;")
+
+    @_locked
+    def mark_seen(self, paths: Iterable[str]):
+        self.conn.executemany("INSERT OR IGNORE INTO temp.scan_seen(path) VALUES (?)", [(p,) for p in paths])
+
+    @_locked
+    def finish_scan(self) -> int:
+        """删除本次扫描未见到的行，返回删除数。"""
+        gone = [r[0] for r in self.conn.execute(
+            "SELECT DISTINCT path FROM files WHERE path NOT IN (SELECT path FROM temp.scan_seen)").fetchall()]
+        self.delete_by_paths(gone)
+        self.finish_scan_keep()
+        return len(gone)
+
+    @_locked
+    def finish_scan_keep(self):
+        # 扫描不完整时结束标记而不删除任何行
+        self.conn.execute("DROP TABLE IF EXISTS temp.scan_seen;")
+
+    @_locked
     def get_by_path(self, path: str) -> Optional[Dict[str, Any]]:
+        if self.index is not None:
+            rec = self.index.get(path)
+            return rec.to_dict() if rec else None
         cur = self.conn.cursor()
         cur.execute("SELECT * FROM files WHERE path = ?", (path,))
         row = cur.fetchone()
         cur.close()
         return self.row_to_dict(row) if row else None
 
+    @_locked
+    def get_all_by_path(self, path: str) -> Iterable[Dict[str, Any]]:
+        # 同一路径理论上只有一行；文件被替换（inode 变化）后可能残留旧行
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM files WHERE path = ?", (path,))
+        rows = [self.row_to_dict(r) for r in cur.fetchall()]
+        cur.close()
+        return rows
+
+    @_locked
+    def iter_paths_after(self, after: str, limit: int) -> Iterable[str]:
+        # 按 path 做 keyset 分页，走 idx_files_path
+        cur = self.conn.cursor()
+        cur.execute("SELECT DISTINCT path FROM files WHERE path > ? ORDER BY path LIMIT ?", (after, limit))
+        paths = [r["path"] for r in cur.fetchall()]
+        cur.close()
+        return paths
+
+    @_locked
+    def has_rows_under(self, dirpath: str) -> bool:
+        prefix = dirpath.rstrip(os.sep) + os.sep
+        cur = self.conn.cursor()
+        cur.execute("SELECT 1 FROM files WHERE path >= ? AND path < ? LIMIT 1",
+                    (prefix, prefix[:-1] + chr(ord(os.sep) + 1)))
+        row = cur.fetchone()
+        cur.close()
+        return row is not None
+
+    @_locked
+    def count_files(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    @_locked
     def delete_by_path(self, path: str):
         cur = self.conn.cursor()
         cur.execute("DELETE FROM files WHERE path = ?", (path,))
         cur.close()
+        if self.index is not None:
+            self.index.remove(path)
 
+    @_locked
     def get_by_devino(self, dev: int, ino: int, category: Optional[str] = None) -> Iterable[Dict[str, Any]]:
+        if self.index is not None:
+            return [r.to_dict() for r in self.index.siblings(dev, ino, category)]
         cur = self.conn.cursor()
         if category:
             cur.execute("SELECT * FROM files WHERE dev=? AND ino=? AND category=?", (dev, ino, category))
@@ -94,13 +301,59 @@ class Database:
         cur.close()
         return rows
 
+    @_locked
     def replace_path_record(self, old_path: str, new_path: str, new_category: str):
         # 重命名/移动：删除旧记录，按新路径 stat 后写入
         self.delete_by_path(old_path)
         return self.upsert_from_stat(new_path, new_category)
 
+    @_locked
     def clear_all(self):
         self.conn.execute("DELETE FROM files;")
+        if self.index is not None:
+            self.index.clear()
+
+    # ---- 维护：检查点与 vacuum ----
+    def wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.db_path + "-wal")
+        except OSError:
+            return 0
+
+    @_locked
+    def checkpoint(self, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+        """执行 WAL 检查点，返回 (busy, WAL 帧数, 已回写帧数)。"""
+        with profiling.stage(f"db.checkpoint.{mode.lower()}"):
+            return tuple(self.conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+
+    @_locked
+    def page_stats(self) -> Dict[str, int]:
+        cur = self.conn.cursor()
+        stats = {
+            "page_size": cur.execute("PRAGMA page_size;").fetchone()[0],
+            "page_count": cur.execute("PRAGMA page_count;").fetchone()[0],
+            "freelist_count": cur.execute("PRAGMA freelist_count;").fetchone()[0],
+            "auto_vacuum": cur.execute("PRAGMA auto_vacuum;").fetchone()[0],
+        }
+        cur.close()
+        return stats
+
+    @_locked
+    def incremental_vacuum(self, pages: int):
+        with profiling.stage("db.vacuum"):
+            # execute() 只单步执行一次（仅释放一页），executescript 才会执行到结束
+            self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+
+    @_locked
+    def vacuum(self):
+        """完整重建：应用新的 page_size 并把旧库切换为 auto_vacuum=INCREMENTAL。"""
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode=DELETE;")  # WAL 模式下无法修改 page_size
+        cur.execute(f"PRAGMA page_size={int(DB_PAGE_SIZE)};")
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        cur.execute("VACUUM;")
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.close()
 
     # 业务动作封装：
     def handle_create_or_modify(self, path: str, category: str):
@@ -110,50 +363,89 @@ class Database:
 
     def handle_move(self, src_path: str, dst_path: str, dst_category: str):
         if os.path.isfile(dst_path):
-            existing = self.get_by_path(src_path)
-            if existing:
-                self.replace_path_record(src_path, dst_path, dst_category)
-            else:
-                self.upsert_from_stat(dst_path, dst_category)
+            with self._lock:
+                existing = self.get_by_path(src_path)
+                if existing:
+                    self.replace_path_record(src_path, dst_path, dst_category)
+                else:
+                    self.upsert_from_stat(dst_path, dst_category)
 
     def handle_delete(self, path: str):
-        row = self.get_by_path(path)
-        if not row:
-            return
-        dev, ino, category = row["dev"], row["ino"], row["category"]
-        # 删除本条记录
-        self.delete_by_path(path)
+        self.handle_delete_batch([path])
+
+    @_locked
+    def get_by_paths(self, paths: List[str]) -> List[Dict[str, Any]]:
+        if self.index is not None:
+            return [rec.to_dict() for rec in map(self.index.get, paths) if rec is not None]
+        rows = []
+        for i in range(0, len(paths), SQL_BATCH):
+            chunk = paths[i:i + SQL_BATCH]
+            cur = self.conn.execute(
+                f"SELECT * FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+            rows.extend(self.row_to_dict(r) for r in cur.fetchall())
+        return rows
+
+    @_locked
+    def get_sources_for_devinos(self, devinos: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        # 一次查询取回所有硬链接兄弟中的源文件
+        if self.index is not None:
+            return [r.to_dict() for dev, ino in devinos for r in self.index.siblings(dev, ino, "source")]
+        rows = []
+        for i in range(0, len(devinos), SQL_BATCH // 2):
+            chunk = devinos[i:i + SQL_BATCH // 2]
+            params = [v for pair in chunk for v in pair]
+            cur = self.conn.execute(
+                f"SELECT * FROM files WHERE category='source' AND (dev, ino) IN "
+                f"(VALUES {','.join(['(?, ?)'] * len(chunk))})", params)
+            rows.extend(self.row_to_dict(r) for r in cur.fetchall())
+        return rows
+
+    @_locked
+    def delete_by_paths(self, paths: List[str]):
+        self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+        if self.index is not None:
+            for p in paths:
+                self.index.remove(p)
+
+    def handle_delete_batch(self, paths: List[str]):
+        """批量处理删除：一次查询解析所有硬链接源文件，插件按批接收通知。"""
+        with self._lock:
+            with profiling.stage("sql.lookup"):
+                rows = self.get_by_paths(list(dict.fromkeys(paths)))
+            if not rows:
+                return
+            # 非媒体记录直接删除；媒体记录留到联动完成后再删，
+            # 中途崩溃时事件日志重放仍能查到记录并重新执行联动
+            media = [r for r in rows if r["category"] == "media"]
+            others = [r["path"] for r in rows if r["category"] != "media"]
+            if others:
+                self.delete_by_paths(others)
 
         # 若删除媒体文件，同步删除具有相同 inode 的源文件（硬链接）
-        if category == "media":
-
-            cleanup_transfer_task(get_filename_from_path(path))
-
-            sources = list(self.get_by_devino(dev, ino, "source"))
-            for s in sources:
-                spath = s["path"]
-                try:
-                    if os.path.exists(spath) and os.path.isfile(spath):
-                        # 在删除源文件前，先处理 qBittorrent 任务（如果启用）
-                        if QB_ENABLED:
-                            print(f"[QB] Processing qBittorrent task for file: {os.path.basename(spath)}")
-                            try:
-                                result = get_torrent_hash_from_file(spath)
-                                if result[0]:  # 如果找到了对应的种子
-                                    torrent_hash, file_index, torrent_deleted = result
-                                    if torrent_deleted:
-                                        print(f"[QB] Successfully removed torrent task: {torrent_hash[:8]}...")
-                                    else:
-                                        print(f"[QB] Set file priority to 0 for torrent: {torrent_hash[:8]}... (torrent kept - has other files)")
-                                else:
-                                    print(f"[QB] No matching torrent found for file: {os.path.basename(spath)}")
-                            except Exception as qb_error:
-                                print(f"[QB] Error processing qBittorrent task: {qb_error}")
-                        
-                        print(f"[DELETE] Removing source file: {os.path.basename(spath)}")
-                        os.remove(spath)
-                        print(f"[DELETE] Source file removed successfully")
-                except Exception:
-                    # 文件可能已不存在或权限问题，继续清理 DB
-                    pass
-                self.delete_by_path(spath)
+        if not media:
+            return
+
+        # 插件（同步模式可能耗时数秒）在锁外执行，不阻塞其它 worker 写库
+        self.integrations.dispatch_batch(HOOK_MEDIA_DELETE, [r["path"] for r in media])
+
+        devinos = list(dict.fromkeys((r["dev"], r["ino"]) for r in media))
+        with profiling.stage("sql.siblings"):
+            sources = self.get_sources_for_devinos(devinos)
+        spaths = list(dict.fromkeys(s["path"] for s in sources))
+        existing = [p for p in spaths if os.path.exists(p) and os.path.isfile(p)]
+        if existing:
+            # 在删除源文件前，先通知插件（如 qBittorrent）
+            self.integrations.dispatch_batch(HOOK_SOURCE_DELETE, existing)
+
+        for spath in existing:
+            try:
+                print(f"[DELETE] Removing source file: {os.path.basename(spath)}")
+                with profiling.stage("delete.remove"):
+                    os.remove(spath)
+                print(f"[DELETE] Source file removed successfully")
+            except Exception:
+                # 文件可能已不存在或权限问题，继续清理 DB
+                pass
+        with self._lock:
+            self.delete_by_paths(spaths)
+            self.delete_by_paths([r["path"] for r in media])
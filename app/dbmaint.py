@@ -0,0 +1,137 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from db import Database
+
+_MB = 1024 * 1024
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+class DBMaintainer:
+    """后台数据库维护：空闲时做 WAL 检查点，大批量写入后收缩 WAL，按需增量 vacuum。
+
+    - 写入活动以主连接的 total_changes 与 WAL 文件大小判断（巡检使用独立连接，
+      其写入体现在 WAL 大小上）；
+    - 自上次检查点累计写入超过 truncate_after_rows 行，且已空闲 1 秒：TRUNCATE 检查点，
+      把 WAL 文件截断为 0，避免一次全量扫描后留下数百 MB 的 WAL；
+    - 连续空闲 idle_seconds 秒且 WAL 非空：PASSIVE 检查点，不等待读者，不阻塞写入；
+    - 每 interval 秒检查一次空闲页比例，超过 vacuum_freelist_pct 时在空闲期增量
+      vacuum（每次最多 vacuum_pages 页；仅 auto_vacuum=INCREMENTAL 的库）。
+
+    检查点与 vacuum 经 Database 的锁执行，与 worker 的写事务串行。
+    """
+
+    def __init__(self, db: Database, idle_seconds: float = 5.0, truncate_after_rows: int = 10000,
+                 vacuum_freelist_pct: float = 10.0, vacuum_pages: int = 2000, interval: float = 60.0,
+                 poll: float = 1.0):
+        self.db = db
+        self.idle_seconds = idle_seconds
+        self.truncate_after_rows = truncate_after_rows
+        self.vacuum_freelist_pct = vacuum_freelist_pct
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self.poll = poll
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._changes = db.conn.total_changes
+        self._wal = db.wal_size()
+        self._last_write = time.monotonic()
+        self._pending_rows = 0      # 自上次检查点以来的写入行数
+        self._wal_checkpointed = -1  # 上次 PASSIVE 检查点后的 WAL 大小，未变化则不重复
+        self._next_maint = time.monotonic() + interval
+        self.checkpoints: Dict[str, Dict[str, float]] = {}
+        self.vacuumed_pages = 0
+
+    # ---- 生命周期 ----
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dbmaint", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ---- 维护动作 ----
+    def checkpoint(self, mode: str = "PASSIVE", reason: str = "") -> bool:
+        """执行一次检查点并记录耗时与 WAL 大小变化；返回是否完整回写。"""
+        before = self.db.wal_size()
+        t0 = time.perf_counter()
+        busy, log, done = self.db.checkpoint(mode)
+        ms = (time.perf_counter() - t0) * 1000
+        after = self.db.wal_size()
+        st = self.checkpoints.setdefault(mode, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        st["count"] += 1
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        complete = not busy and done == log
+        if complete:
+            self._pending_rows = 0
+        self._changes = self.db.conn.total_changes
+        self._wal = after
+        # PASSIVE 在无事可做时不刷屏
+        if mode != "PASSIVE" or log:
+            # TRUNCATE 截断后 SQLite 报告的帧数为 0，只看 WAL 大小
+            frames = f"{done}/{log} frames, " if log else ""
+            print(f"[DB] Checkpoint {mode}{f' ({reason})' if reason else ''}: {ms:.1f}ms, "
+                  f"{frames}WAL {before / _MB:.1f} MB -> {after / _MB:.1f} MB"
+                  f"{'' if complete else ' (readers busy)'}")
+        return complete
+
+    def vacuum(self) -> int:
+        """空闲页比例超过阈值时增量 vacuum，返回释放的页数。"""
+        st = self.db.page_stats()
+        if st["auto_vacuum"] != _AUTO_VACUUM_INCREMENTAL or not st["page_count"]:
+            return 0
+        pct = st["freelist_count"] * 100.0 / st["page_count"]
+        if pct < self.vacuum_freelist_pct:
+            return 0
+        t0 = time.perf_counter()
+        self.db.incremental_vacuum(self.vacuum_pages)
+        freed = st["freelist_count"] - self.db.page_stats()["freelist_count"]
+        self.vacuumed_pages += freed
+        print(f"[DB] Incremental vacuum: freed {freed} pages ({freed * st['page_size'] / _MB:.1f} MB, "
+              f"freelist was {pct:.1f}%) in {(time.perf_counter() - t0) * 1000:.1f}ms")
+        return freed
+
+    def stats(self) -> Dict:
+        out = {mode: {"count": int(s["count"]), "avg_ms": round(s["total_ms"] / s["count"], 2),
+                      "max_ms": round(s["max_ms"], 2)}
+               for mode, s in self.checkpoints.items() if s["count"]}
+        out["wal_mb"] = round(self.db.wal_size() / _MB, 2)
+        out["vacuumed_pages"] = self.vacuumed_pages
+        return out
+
+    # ---- 主循环 ----
+    def _tick(self):
+        now = time.monotonic()
+        changes = self.db.conn.total_changes
+        wal = self.db.wal_size()
+        if changes != self._changes or wal != self._wal:
+            self._pending_rows += changes - self._changes
+            self._changes, self._wal = changes, wal
+            self._last_write = now
+        idle = now - self._last_write
+
+        if self._pending_rows >= self.truncate_after_rows and idle >= self.poll:
+            self.checkpoint("TRUNCATE", f"{self._pending_rows} rows since last checkpoint")
+        elif idle >= self.idle_seconds and wal > 0 and (self._pending_rows or wal != self._wal_checkpointed):
+            self.checkpoint("PASSIVE")
+            self._wal_checkpointed = self.db.wal_size()
+
+        if now >= self._next_maint:
+            self._next_maint = now + self.interval
+            if idle >= self.idle_seconds:
+                self.vacuum()
+            if wal or self._pending_rows:
+                print(f"[DB] WAL {wal / _MB:.1f} MB, {self._pending_rows} rows since last checkpoint")
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            try:
+                self._tick()
+            except Exception as e:
+                print(f"[DB] Maintenance error: {e}")
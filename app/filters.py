@@ -0,0 +1,85 @@
+import fnmatch
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+_DIR_CACHE_MAX = 4096
+
+
+def _compile_globs(globs: Iterable[str]) -> Optional["re.Pattern"]:
+    # 多个 glob 合并为一个正则，一次 match 完成判断
+    parts = [fnmatch.translate(g) for g in globs]
+    return re.compile("|".join(parts)) if parts else None
+
+
+def _norm_exts(exts: Iterable[str]) -> frozenset:
+    return frozenset(("." + e.lstrip(".")).lower() for e in exts if e)
+
+
+class PathFilter:
+    """扫描 / 监听 / 分类共用的包含与排除规则，构造时编译一次。
+
+    - exclude_globs: 文件名 glob（如 ".DS_Store"、"*.!qB"），合并为单个正则
+    - exclude_exts / include_exts: 扩展名集合，不区分大小写；include_exts 为空表示不限
+    - prune_dirs: 目录名（可含 glob），命中的目录不遍历，其下事件直接丢弃
+    - min_size: 小于该字节数的文件不入库（需要 stat，在其余规则之后判断）
+    """
+
+    def __init__(self, exclude_globs: Iterable[str] = (), exclude_exts: Iterable[str] = (),
+                 include_exts: Iterable[str] = (), prune_dirs: Iterable[str] = (), min_size: int = 0):
+        self._name_re = _compile_globs(exclude_globs)
+        self._exclude_exts = _norm_exts(exclude_exts)
+        self._include_exts = _norm_exts(include_exts)
+        prune = list(prune_dirs)
+        # 纯字面量目录名走集合查找，带通配符的才进正则
+        self._prune_names = frozenset(p for p in prune if not any(c in p for c in "*?["))
+        self._prune_re = _compile_globs(p for p in prune if any(c in p for c in "*?["))
+        self.min_size = min_size
+        # 目录判定缓存：同目录下的文件只拆分一次路径
+        self._dir_cache: Dict[str, bool] = {}
+
+    def include_name(self, name: str) -> bool:
+        """按文件名判断（不访问磁盘）。"""
+        if self._exclude_exts or self._include_exts:
+            dot = name.rfind(".")
+            ext = name[dot:].lower() if dot > 0 else ""
+            if ext in self._exclude_exts:
+                return False
+            if self._include_exts and ext not in self._include_exts:
+                return False
+        if self._name_re is not None and self._name_re.match(name):
+            return False
+        return True
+
+    def prune_dir(self, name: str) -> bool:
+        """目录名是否应被剪除。"""
+        if name in self._prune_names:
+            return True
+        return self._prune_re is not None and self._prune_re.match(name) is not None
+
+    def include_dir(self, path: str) -> bool:
+        """目录路径上任何一级被剪除则返回 False。"""
+        if not self._prune_names and self._prune_re is None:
+            return True
+        ok = self._dir_cache.get(path)
+        if ok is None:
+            ok = not any(self.prune_dir(part) for part in path.split(os.sep) if part)
+            if len(self._dir_cache) >= _DIR_CACHE_MAX:
+                self._dir_cache.clear()
+            self._dir_cache[path] = ok
+        return ok
+
+    def include_path(self, path: str) -> bool:
+        """文件路径：所在目录未被剪除且文件名通过规则。"""
+        d, name = os.path.split(path)
+        return self.include_name(name) and self.include_dir(d)
+
+    def include_size(self, size: int) -> bool:
+        return size >= self.min_size
+
+
+def build_filter() -> PathFilter:
+    """按 config 中的 SCAN_* 配置构造过滤器。"""
+    from config import SCAN_EXCLUDE_GLOBS, SCAN_EXCLUDE_EXTS, SCAN_INCLUDE_EXTS, SCAN_PRUNE_DIRS, SCAN_MIN_SIZE
+    return PathFilter(exclude_globs=SCAN_EXCLUDE_GLOBS, exclude_exts=SCAN_EXCLUDE_EXTS,
+                      include_exts=SCAN_INCLUDE_EXTS, prune_dirs=SCAN_PRUNE_DIRS, min_size=SCAN_MIN_SIZE)
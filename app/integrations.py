@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Tuple
+
+import profiling
+
+# 可注册的钩子
+# 媒体记录在整个联动（两个钩子与删除源文件）完成后才从 DB 移除，中途崩溃时事件日志
+# 重放会再次调用钩子：同一路径可能收到重复通知，处理函数必须幂等
+HOOK_MEDIA_DELETE = "media_delete"    # 媒体文件已从磁盘删除（DB 记录仍在，联动完成后移除）
+HOOK_SOURCE_DELETE = "source_delete"  # 硬链接源文件即将被删除
+
+# 执行模式
+MODE_SYNC = "sync"    # 调用方等待完成（最多 timeout 秒）
+MODE_ASYNC = "async"  # 提交到插件自己的线程池后立即返回
+MODE_BATCH = "batch"  # 在 batch_window 内累积，合并成一次 handle_batch 调用
+MODES = (MODE_SYNC, MODE_ASYNC, MODE_BATCH)
+
+
+class Integration:
+    """删除联动插件基类。
+
+    子类声明 name / hooks，并实现 handle()；批量模式下可覆盖 handle_batch()
+    以合并外部调用。mode / concurrency / timeout 由注册表按配置传入。
+    """
+    name = "integration"
+    hooks: Tuple[str, ...] = ()
+
+    def __init__(self, mode: str = MODE_SYNC, concurrency: int = 1, timeout: float = 60.0,
+                 batch_window: float = 2.0, batch_size: int = 100):
+        if mode not in MODES:
+            raise ValueError(f"Unknown integration mode for {self.name}: {mode}")
+        self.mode = mode
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.batch_size = max(1, int(batch_size))
+
+    def handle(self, hook: str, path: str):
+        raise NotImplementedError
+
+    def handle_batch(self, hook: str, paths: List[str]):
+        # 默认逐条处理；支持批量 API 的插件可覆盖
+        for p in paths:
+            try:
+                self.handle(hook, p)
+            except Exception as e:
+                print(f"[PLUGIN] {self.name} failed on {p}: {e}")
+
+
+class _Runner:
+    """单个插件的执行器：独立线程池、并发上限与超时。"""
+
+    def __init__(self, plugin: Integration):
+        self.plugin = plugin
+        self.pool = ThreadPoolExecutor(max_workers=plugin.concurrency,
+                                       thread_name_prefix=f"plugin-{plugin.name}")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[str]] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def _call(self, fn, *args):
+        start = time.monotonic()
+        try:
+            with profiling.stage(f"plugin.{self.plugin.name}"):
+                return fn(*args)
+        except Exception as e:
+            print(f"[PLUGIN] {self.plugin.name} error: {e}")
+        finally:
+            elapsed = time.monotonic() - start
+            if self.plugin.timeout and elapsed > self.plugin.timeout:
+                print(f"[PLUGIN] {self.plugin.name} overran timeout ({elapsed:.1f}s > {self.plugin.timeout}s)")
+
+    def submit(self, hook: str, path: str):
+        mode = self.plugin.mode
+        if mode == MODE_BATCH:
+            self._enqueue(hook, path)
+            return
+        future = self.pool.submit(self._call, self.plugin.handle, hook, path)
+        if mode == MODE_SYNC:
+            try:
+                future.result(timeout=self.plugin.timeout)
+            except FutureTimeout:
+                print(f"[PLUGIN] {self.plugin.name} timed out after {self.plugin.timeout}s, continuing: {path}")
+
+    def submit_batch(self, hook: str, paths: List[str]):
+        mode = self.plugin.mode
+        if mode == MODE_BATCH:
+            for p in paths:
+                self._enqueue(hook, p)
+            return
+        future = self.pool.submit(self._call, self.plugin.handle_batch, hook, list(paths))
+        if mode == MODE_SYNC:
+            try:
+                future.result(timeout=self.plugin.timeout)
+            except FutureTimeout:
+                print(f"[PLUGIN] {self.plugin.name} timed out after {self.plugin.timeout}s, continuing: {len(paths)} files")
+
+    def _enqueue(self, hook: str, path: str):
+        with self._lock:
+            items = self._pending.setdefault(hook, [])
+            items.append(path)
+            full = len(items) >= self.plugin.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.plugin.batch_window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for hook, paths in pending.items():
+            if paths:
+                self.pool.submit(self._call, self.plugin.handle_batch, hook, paths)
+
+    def shutdown(self, wait: bool = True):
+        self.flush()
+        self.pool.shutdown(wait=wait)
+
+
+class IntegrationRegistry:
+    def __init__(self):
+        self._runners: Dict[str, List[_Runner]] = {}
+        self._all: List[_Runner] = []
+
+    def register(self, plugin: Integration):
+        runner = _Runner(plugin)
+        self._all.append(runner)
+        for hook in plugin.hooks:
+            self._runners.setdefault(hook, []).append(runner)
+        print(f"[PLUGIN] Registered {plugin.name} ({plugin.mode}, concurrency={plugin.concurrency}, timeout={plugin.timeout}s) for {', '.join(plugin.hooks)}")
+        return plugin
+
+    def has(self, hook: str) -> bool:
+        return bool(self._runners.get(hook))
+
+    def dispatch(self, hook: str, path: str):
+        for runner in self._runners.get(hook, ()):
+            runner.submit(hook, path)
+
+    def dispatch_batch(self, hook: str, paths: List[str]):
+        if not paths:
+            return
+        if len(paths) == 1:
+            self.dispatch(hook, paths[0])
+            return
+        for runner in self._runners.get(hook, ()):
+            runner.submit_batch(hook, paths)
+
+    def flush(self):
+        for runner in self._all:
+            runner.flush()
+
+    def shutdown(self, wait: bool = True):
+        for runner in self._all:
+            runner.shutdown(wait=wait)
+
+
+# ---------------- 内置插件 ----------------
+class MoviePilotIntegration(Integration):
+    """删除媒体文件后清理 MoviePilot 的整理记录。"""
+    name = "moviepilot"
+    hooks = (HOOK_MEDIA_DELETE,)
+
+    def handle(self, hook: str, path: str):
+        # 延迟导入：未启用时不加载 requests / moviepilot
+        from moviepilot import cleanup_transfer_task
+        cleanup_transfer_task(os.path.basename(path))
+
+    def handle_batch(self, hook: str, paths: List[str]):
+        # 一次校验令牌，批量查询并删除整理记录
+        from moviepilot import cleanup_transfer_tasks
+        cleanup_transfer_tasks([os.path.basename(p) for p in paths])
+
+
+class QBittorrentIntegration(Integration):
+    """删除源文件前，将 qBittorrent 中对应文件设为不下载，必要时删除种子。"""
+    name = "qbittorrent"
+    hooks = (HOOK_SOURCE_DELETE,)
+
+    def handle(self, hook: str, path: str):
+        from qb import get_torrent_hash_from_file
+        print(f"[QB] Processing qBittorrent task for file: {os.path.basename(path)}")
+        try:
+            result = get_torrent_hash_from_file(path)
+            if result[0]:  # 如果找到了对应的种子
+                torrent_hash, file_index, torrent_deleted = result
+                if torrent_deleted:
+                    print(f"[QB] Successfully removed torrent task: {torrent_hash[:8]}...")
+                else:
+                    print(f"[QB] Set file priority to 0 for torrent: {torrent_hash[:8]}... (torrent kept - has other files)")
+            else:
+                print(f"[QB] No matching torrent found for file: {os.path.basename(path)}")
+        except Exception as qb_error:
+            print(f"[QB] Error processing qBittorrent task: {qb_error}")
+
+    def handle_batch(self, hook: str, paths: List[str]):
+        # 一次登录，按种子分组：每个种子一次 filePrio，至多删除一次
+        from qb import process_files_batch
+        print(f"[QB] Processing qBittorrent tasks for {len(paths)} files")
+        try:
+            results = process_files_batch(paths)
+        except Exception as qb_error:
+            print(f"[QB] Error processing qBittorrent batch: {qb_error}")
+            return
+        for torrent_hash, (indexes, torrent_deleted) in results.items():
+            if torrent_deleted:
+                print(f"[QB] Successfully removed torrent task: {torrent_hash[:8]}... ({len(indexes)} files)")
+            else:
+                print(f"[QB] Set file priority to 0 for torrent: {torrent_hash[:8]}... ({len(indexes)} files, torrent kept)")
+
+
+BUILTIN_INTEGRATIONS = {
+    MoviePilotIntegration.name: MoviePilotIntegration,
+    QBittorrentIntegration.name: QBittorrentIntegration,
+}
+
+
+def build_default_registry() -> IntegrationRegistry:
+    """按 config 中的开关与参数注册内置插件；未启用的插件不会被导入或调用。"""
+    from config import QB_ENABLED, MP_ENABLED, INTEGRATIONS
+    enabled = {
+        MoviePilotIntegration.name: MP_ENABLED,
+        QBittorrentIntegration.name: QB_ENABLED,
+    }
+    registry = IntegrationRegistry()
+    # 注册顺序即同一钩子上的执行顺序
+    for name, cls in BUILTIN_INTEGRATIONS.items():
+        if not enabled.get(name):
+            continue
+        registry.register(cls(**INTEGRATIONS.get(name, {})))
+    return registry
@@ -0,0 +1,246 @@
+import contextlib
+import ctypes
+import os
+import platform
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+# ioprio_set(2)：glibc 没有封装，直接走系统调用
+_SYS_IOPRIO_SET = {"x86_64": 251, "i686": 289, "aarch64": 30, "armv7l": 314}
+_SYS_IOPRIO_GET = {"x86_64": 252, "i686": 290, "aarch64": 31, "armv7l": 315}
+_IOPRIO_WHO_PROCESS = 1   # who=线程 id 时只作用于该线程
+_IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3     # 磁盘空闲时才调度
+
+
+def _ioprio_syscall(table: Dict[str, int], *args) -> int:
+    nr = table.get(platform.machine())
+    if nr is None or not hasattr(threading, "get_native_id"):
+        return -1
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return -1
+    return libc.syscall(nr, _IOPRIO_WHO_PROCESS, threading.get_native_id(), *args)
+
+
+@contextlib.contextmanager
+def io_priority(idle: bool = False, nice: Optional[int] = None):
+    """在 with 块内降低当前线程的 CPU / I/O 优先级，退出时恢复。
+
+    idle=True 时设置 ioprio 的 IDLE 类（仅 Linux，CFQ/BFQ 调度器生效）；
+    nice 为线程级 nice 值。不支持的平台上静默跳过。
+
+    注意：非 root 用户无法把 nice 调回更高优先级，且之后创建的线程会继承当前值；
+    只应在专用线程中使用（见 run_prioritized），不要在主线程或会派生长期线程的线程中使用。
+    """
+    old_prio = old_nice = None
+    tid = threading.get_native_id() if hasattr(threading, "get_native_id") else None
+    if idle:
+        cur = _ioprio_syscall(_SYS_IOPRIO_GET)
+        if cur >= 0 and _ioprio_syscall(_SYS_IOPRIO_SET, IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) == 0:
+            old_prio = cur
+    if nice is not None and tid is not None and hasattr(os, "setpriority"):
+        try:
+            old_nice = os.getpriority(os.PRIO_PROCESS, tid)
+            os.setpriority(os.PRIO_PROCESS, tid, nice)
+        except OSError:
+            old_nice = None
+    try:
+        yield
+    finally:
+        if old_prio is not None:
+            _ioprio_syscall(_SYS_IOPRIO_SET, old_prio)
+        if old_nice is not None:
+            try:
+                # 非 root 无法调回更高优先级，忽略
+                os.setpriority(os.PRIO_PROCESS, tid, old_nice)
+            except OSError:
+                pass
+
+
+def run_prioritized(fn: Callable, *args, idle: bool = False, nice: Optional[int] = None,
+                    name: str = "prioritized"):
+    """在一个短生命周期的专用线程中以降低的优先级执行 fn(*args)，等待并返回其结果。
+
+    优先级随线程结束而消失，调用线程及之后创建的线程不受影响；fn 抛出的异常在调用线程重新抛出。
+    """
+    if not idle and nice is None:
+        return fn(*args)
+    result = {}
+
+    def target():
+        try:
+            with io_priority(idle, nice):
+                result["value"] = fn(*args)
+        except BaseException as e:
+            result["error"] = e
+
+    t = threading.Thread(target=target, name=name, daemon=True)
+    t.start()
+    t.join()
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+class _TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.burst = max(1.0, rate / 10)  # 允许约 100ms 的突发
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def delay(self) -> float:
+        # 取一个令牌，返回需要等待的秒数（令牌允许为负，等待期间由后续调用者分摊）
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class _Device:
+    """单个 st_dev 的预算与延迟状态；stat / 目录各一个可复用的上下文对象。"""
+
+    def __init__(self, sched: "IOScheduler", dev: int, stat_rate: float, dir_rate: float):
+        self.dev = dev
+        self.ewma: Optional[float] = None
+        self.factor = 1.0   # 1.0 表示不退让；越小额外停顿越长
+        self.ops = 0
+        self.ctx = {
+            IOScheduler.STAT: _Op(sched, self, _TokenBucket(stat_rate) if stat_rate > 0 else None),
+            IOScheduler.DIR: _Op(sched, self, _TokenBucket(dir_rate) if dir_rate > 0 else None),
+        }
+
+
+class _Op:
+    __slots__ = ("sched", "dev", "bucket", "t0")
+
+    def __init__(self, sched: "IOScheduler", dev: _Device, bucket: Optional[_TokenBucket]):
+        self.sched = sched
+        self.dev = dev
+        self.bucket = bucket
+        self.t0 = 0.0
+
+    def __enter__(self):
+        if self.bucket is not None:
+            delay = self.bucket.delay()
+            if delay > 0:
+                self.sched.stop.wait(delay)
+        self.t0 = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        if self.sched.adaptive:
+            latency = time.monotonic() - self.t0
+            d = self.dev
+            self.sched._observe(d, latency)
+            if d.factor < 1.0:
+                self.sched.stop.wait(latency * (1.0 / d.factor - 1.0))
+        return False
+
+
+class IOScheduler:
+    """扫描用的按设备 I/O 调度：令牌桶限速 + 基于 stat 延迟的自适应退让。
+
+    - stat_rate / dir_rate：每个设备（st_dev）每秒允许的 stat 与目录读取次数，0 表示不限；
+      device_budgets 可按设备覆盖，键为 st_dev 或该设备上的任一路径；
+    - adaptive：对每个设备维护操作延迟的 EWMA，每 window 次操作调整一次退让系数 factor：
+      超过 latency_target 时减半（下限 min_factor），否则每次加回 0.05（AIMD）。
+      factor < 1 时每次操作后额外停顿 latency * (1/factor - 1)，即磁盘忙时
+      扫描只占用约 factor 比例的设备时间，为 Plex 播放 / 做种让出磁头。
+
+    未启用任何限制时 op() 返回共享的空上下文，开销可以忽略。
+    每个扫描线程使用各自的实例（全量扫描、各分片进程、巡检线程），内部不加锁。
+    """
+    STAT = "stat"
+    DIR = "dir"
+
+    def __init__(self, stat_rate: float = 0, dir_rate: float = 0,
+                 device_budgets: Optional[Dict[Union[int, str], Tuple[float, float]]] = None,
+                 adaptive: bool = True, latency_target: float = 0.05, min_factor: float = 0.05,
+                 window: int = 32, stop: Optional[threading.Event] = None):
+        self.stat_rate = stat_rate
+        self.dir_rate = dir_rate
+        self.budgets: Dict[int, Tuple[float, float]] = {}
+        for key, budget in (device_budgets or {}).items():
+            if isinstance(key, str):
+                try:
+                    key = os.stat(os.path.expanduser(key)).st_dev
+                except OSError:
+                    print(f"[IO] Ignoring budget for missing path: {key}")
+                    continue
+            self.budgets[key] = budget
+        self.adaptive = adaptive
+        self.latency_target = latency_target
+        self.min_factor = min_factor
+        self.window = max(1, window)
+        self.stop = stop or threading.Event()
+        self.active = bool(adaptive or stat_rate > 0 or dir_rate > 0 or self.budgets)
+        self._devices: Dict[int, _Device] = {}
+        self._roots: Tuple[Tuple[str, int], ...] = ()
+
+    # ---- 设备解析 ----
+    def add_roots(self, roots: Iterable[str]):
+        """登记扫描根目录的设备号，dev_for() 按最长前缀匹配。"""
+        table = dict(self._roots)
+        for r in roots:
+            try:
+                table[os.path.abspath(r)] = os.stat(r).st_dev
+            except OSError:
+                continue
+        self._roots = tuple(sorted(table.items(), key=lambda kv: len(kv[0]), reverse=True))
+
+    def dev_for(self, path: str) -> int:
+        for root, dev in self._roots:
+            if path == root or path.startswith(root + os.sep):
+                return dev
+        return -1
+
+    def _device(self, dev: int) -> _Device:
+        d = self._devices.get(dev)
+        if d is None:
+            stat_rate, dir_rate = self.budgets.get(dev, (self.stat_rate, self.dir_rate))
+            d = self._devices[dev] = _Device(self, dev, stat_rate, dir_rate)
+        return d
+
+    # ---- 调度 ----
+    def op(self, kind: str, path: Optional[str] = None, dev: Optional[int] = None):
+        """包裹一次 stat / scandir：按预算等待，执行后记录延迟并按需退让。"""
+        if not self.active:
+            return _NULL_OP
+        return self._device(self.dev_for(path) if dev is None else dev).ctx[kind]
+
+    def _observe(self, d: _Device, latency: float):
+        d.ewma = latency if d.ewma is None else d.ewma * 0.9 + latency * 0.1
+        d.ops += 1
+        if d.ops % self.window:
+            return
+        old = d.factor
+        if d.ewma > self.latency_target:
+            d.factor = max(self.min_factor, d.factor * 0.5)
+        else:
+            d.factor = min(1.0, d.factor + 0.05)
+        if old == 1.0 and d.factor < 1.0:
+            print(f"[IO] Device {d.dev}: stat latency {d.ewma * 1000:.1f}ms > "
+                  f"{self.latency_target * 1000:.0f}ms, backing off")
+        elif old < 1.0 and d.factor == 1.0:
+            print(f"[IO] Device {d.dev}: latency recovered ({d.ewma * 1000:.1f}ms), full speed")
+
+    def stats(self) -> Dict[int, Dict]:
+        return {dev: {"ops": d.ops, "ewma_ms": round((d.ewma or 0) * 1000, 2), "factor": round(d.factor, 3)}
+                for dev, d in self._devices.items()}
+
+
+_NULL_OP = contextlib.nullcontext()
+
+
+def build_scheduler(stop: Optional[threading.Event] = None) -> IOScheduler:
+    """按 config 中的 IO_* 配置构造调度器。"""
+    from config import IO_STAT_PER_SEC, IO_DIR_PER_SEC, IO_DEVICE_BUDGETS, IO_ADAPTIVE, \
+        IO_LATENCY_TARGET_MS, IO_MIN_FACTOR
+    return IOScheduler(stat_rate=IO_STAT_PER_SEC, dir_rate=IO_DIR_PER_SEC, device_budgets=IO_DEVICE_BUDGETS,
+                       adaptive=IO_ADAPTIVE, latency_target=IO_LATENCY_TARGET_MS / 1000.0,
+                       min_factor=IO_MIN_FACTOR, stop=stop)
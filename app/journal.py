@@ -0,0 +1,279 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+class EventJournal:
+    """监听事件的预写日志（追加写、批量 fsync），配合检查点实现崩溃后只重放未处理的尾部。
+
+    文件：
+      <path>       每行一条 JSON：[seq, kind, path(, dst)]
+      <path>.ckpt  检查点：{"applied": 低水位, "seq": 已分配的最大 seq}，临时文件 + rename 原子替换
+
+    - append() 在入队前调用：每条立即 write 到内核（进程崩溃不丢），fsync 由后台线程
+      每 fsync_interval 秒或累积 fsync_batch 条时合并执行（断电最多丢失一个间隔）；
+    - mark_applied() 在事件处理完成后调用，允许乱序完成：低水位只在其下所有 seq
+      都已完成时才前移；
+    - 检查点写入后，日志超过 compact_bytes 时重写为仅含未处理的尾部。
+
+    重放是"至少一次"：检查点之后、崩溃之前已处理的事件会再处理一次，
+    create/modify/move/delete 对数据库都是幂等的。媒体删除的联动（插件通知、删除源文件）
+    完成后才删除媒体记录，中断的联动在重放时整体重做，插件可能收到重复通知。
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 0.1, fsync_batch: int = 256,
+                 checkpoint_interval: float = 5.0, compact_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.ckpt_path = path + ".ckpt"
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.checkpoint_interval = checkpoint_interval
+        self.compact_bytes = compact_bytes
+        self.has_checkpoint = False
+        self._f = None
+        self._lock = threading.Lock()          # 保护文件与 seq 分配
+        self._wake = threading.Condition(self._lock)
+        self._seq = 0                          # 已分配的最大 seq
+        self._unsynced = 0
+        self._lines = 0                        # 日志文件中的记录数
+        self._applied = 0                      # 低水位：<= 它的事件都已处理
+        self._done = set()                     # 低水位之上已完成的 seq
+        self._ckpt_applied = 0
+        self._ckpt_time = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 启动 / 关闭 ----
+    def open(self) -> List[Tuple[int, tuple]]:
+        """读取检查点与日志，返回待重放的 [(seq, item), ...]，并开始接受追加。"""
+        ckpt = {}
+        try:
+            with open(self.ckpt_path, "r") as f:
+                ckpt = json.load(f)
+            self.has_checkpoint = True
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[JOURNAL] Ignoring unreadable checkpoint {self.ckpt_path}: {e}")
+        applied = int(ckpt.get("applied", 0))
+        last = int(ckpt.get("seq", applied))
+
+        pending = []
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的末行
+                        continue
+                    seq = rec[0]
+                    last = max(last, seq)
+                    if seq > applied:
+                        pending.append((seq, tuple(rec[1:])))
+        except FileNotFoundError:
+            pass
+        pending.sort(key=lambda e: e[0])
+
+        self._seq = last
+        self._applied = self._ckpt_applied = applied
+        # 以干净的尾部重写日志，去掉已处理的记录和残缺行
+        self._rewrite(pending)
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+        if pending:
+            print(f"[JOURNAL] {len(pending)} unapplied events to replay (seq {pending[0][0]}..{pending[-1][0]})")
+        return pending
+
+    def close(self):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._lock:
+            self._sync_locked()
+        self.checkpoint()
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    # ---- 写入 ----
+    def append(self, item: tuple) -> int:
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._f.write(json.dumps([seq, *item]) + "\n")
+            self._f.flush()
+            self._lines += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch:
+                self._wake.notify()
+        return seq
+
+    def mark_applied(self, seq: int):
+        with self._lock:
+            if seq <= self._applied:
+                return
+            self._done.add(seq)
+            while self._applied + 1 in self._done:
+                self._applied += 1
+                self._done.discard(self._applied)
+
+    def discard_pending(self):
+        """全量刷新后调用：之前记录的事件已被扫描结果覆盖，全部视为已处理。"""
+        with self._lock:
+            self._applied = self._seq
+            self._done.clear()
+        self.checkpoint(force=True)
+
+    @property
+    def applied(self) -> int:
+        return self._applied
+
+    # ---- 检查点 / 压缩 ----
+    def checkpoint(self, force: bool = False):
+        with self._lock:
+            applied, seq = self._applied, self._seq
+            if not force and applied == self._ckpt_applied:
+                return
+            # 检查点不能超过已落盘的日志
+            self._sync_locked()
+        tmp = self.ckpt_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"applied": applied, "seq": seq}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ckpt_path)
+        self._fsync_dir()
+        self._ckpt_applied = applied
+        self._ckpt_time = time.monotonic()
+        self.has_checkpoint = True
+
+        with self._lock:
+            # 至少能去掉一半记录时才压缩，避免积压时反复重写大尾部
+            if self._f is not None and self._f.tell() > self.compact_bytes \
+                    and (self._seq - applied) * 2 < self._lines:
+                self._compact_locked(applied)
+
+    def _compact_locked(self, applied: int):
+        self._f.flush()
+        tail = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec[0] > applied:
+                    tail.append((rec[0], tuple(rec[1:])))
+        before = self._f.tell()
+        self._f.close()
+        self._rewrite(tail)
+        print(f"[JOURNAL] Compacted {before} -> {self._f.tell()} bytes ({len(tail)} events kept)")
+
+    def _rewrite(self, entries: List[Tuple[int, tuple]]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for seq, item in entries:
+                f.write(json.dumps([seq, *item]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._fsync_dir()
+        self._f = open(self.path, "a")
+        self._lines = len(entries)
+        self._unsynced = 0
+
+    def _sync_locked(self):
+        if self._unsynced and self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._unsynced = 0
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._wake:
+                if self._unsynced < self.fsync_batch:
+                    self._wake.wait(self.fsync_interval)
+                fd = self._f.fileno() if self._unsynced and self._f is not None else None
+                self._unsynced = 0
+            if fd is not None:
+                try:
+                    # 组提交：一次 fsync 覆盖这段时间内追加的所有事件；在锁外执行，不阻塞 append
+                    # （文件只在本线程的 checkpoint 压缩中替换，fd 在此期间有效）
+                    os.fsync(fd)
+                except OSError as e:
+                    print(f"[JOURNAL] fsync failed: {e}")
+            if time.monotonic() - self._ckpt_time >= self.checkpoint_interval:
+                try:
+                    self.checkpoint()
+                except OSError as e:
+                    print(f"[JOURNAL] Checkpoint failed: {e}")
+
+
+class JournaledQueue(queue.Queue):
+    """先写日志再入队的事件队列，对生产者与 worker 透明。
+
+    put() 为事件分配 seq 并追加到日志；worker 每处理完一条调用一次 task_done()，
+    此时按该线程取出的顺序标记对应 seq 已处理。多个 worker 并发时各自维护取出顺序，
+    乱序完成由 EventJournal 的低水位处理。停止信号 None 不写日志。
+    """
+
+    def __init__(self, journal: EventJournal, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.journal = journal
+        self._taken = threading.local()
+
+    def put(self, item, block=True, timeout=None):
+        if item is None:
+            super().put(None, block, timeout)
+            return
+        super().put((self.journal.append(item), item), block, timeout)
+
+    def replay(self, entries: List[Tuple[int, tuple]]):
+        # 重放的事件沿用原 seq，不再写日志
+        for seq, item in entries:
+            super().put((seq, item))
+
+    def get(self, block=True, timeout=None):
+        entry = super().get(block, timeout)
+        if entry is None:
+            return None
+        seq, item = entry
+        taken = getattr(self._taken, "seqs", None)
+        if taken is None:
+            taken = self._taken.seqs = deque()
+        taken.append(seq)
+        return item
+
+    def get_entry(self, block=True, timeout=None):
+        # 分发线程使用：直接取 (seq, item)，完成后调用 done(seq)
+        return super().get(block, timeout)
+
+    def done(self, seq: int):
+        super().task_done()
+        self.journal.mark_applied(seq)
+
+    def task_done(self):
+        super().task_done()
+        taken = getattr(self._taken, "seqs", None)
+        if taken:
+            self.journal.mark_applied(taken.popleft())
@@ -1,4 +1,5 @@
 import argparse
+import multiprocessing
 import os
 import signal
 import sys
@@ -9,9 +10,19 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 from db import Database
+from filters import build_filter
 from scanner import full_refresh
 from watcher import start_watch
-from config import MEDIA_PATH, SOURCE_PATH, DB_PATH
+from config import MEDIA_PATH, SOURCE_PATH, DB_PATH, SHARDS, WATCH_WORKERS
+from config import PROFILE_ENABLED, PROFILE_DUMP_INTERVAL, PROFILE_SAMPLE, PROFILE_SAMPLE_WINDOW, PROFILE_SAMPLE_EVERY, PROFILE_DIR
+from config import MEMINDEX_ENABLED
+from config import JOURNAL_ENABLED, JOURNAL_PATH, JOURNAL_FSYNC_INTERVAL, JOURNAL_FSYNC_BATCH, JOURNAL_CHECKPOINT_INTERVAL, JOURNAL_COMPACT_BYTES
+from config import SWEEP_ENABLED, SWEEP_FILES_PER_SEC, SWEEP_IO_PCT, SWEEP_PERIOD_HOURS, SWEEP_CHUNK_SIZE
+from config import IO_SCAN_IDLE, IO_SCAN_NICE
+from config import DB_CHECKPOINT_IDLE, DB_TRUNCATE_AFTER_ROWS, DB_VACUUM_FREELIST_PCT, DB_VACUUM_PAGES, DB_MAINT_INTERVAL
+from dbmaint import DBMaintainer
+from iothrottle import build_scheduler, run_prioritized
+import profiling
 
 def _norm_dirs(dirs: List[str]) -> List[str]:
     out = []
@@ -45,6 +56,15 @@ def parse_args():
     ap.add_argument("--db", default=os.path.abspath("./index.db"), help="SQLite db path (default: ./index.db)")
     ap.add_argument("--source", action="append", default=[], help="Source directory (repeatable)")
     ap.add_argument("--media", action="append", default=[], help="Media directory (repeatable)")
+    ap.add_argument("--profile", action="store_true", default=PROFILE_ENABLED, help="Enable per-stage timing histograms (SIGUSR1 dumps)")
+    ap.add_argument("--profile-sample", choices=[profiling.SAMPLE_CPROFILE, profiling.SAMPLE_TRACEMALLOC], default=PROFILE_SAMPLE, help="Sampling mode for SIGUSR2-triggered windows")
+    ap.add_argument("--memindex", action="store_true", default=MEMINDEX_ENABLED, help="Mirror the files table in memory for fast lookups")
+    ap.add_argument("--no-journal", dest="journal", action="store_false", default=JOURNAL_ENABLED, help="Disable the event journal (always rescan on startup)")
+    ap.add_argument("--full-refresh", action="store_true", help="Force a full rescan even if the event journal can be replayed")
+    ap.add_argument("--no-sweep", dest="sweep", action="store_false", default=SWEEP_ENABLED, help="Disable the background integrity sweeper")
+    ap.add_argument("--workers", type=int, default=WATCH_WORKERS, help=f"Event worker threads, routed by path hash (default: {WATCH_WORKERS})")
+    ap.add_argument("--shards", type=int, default=SHARDS, help=f"Scan/watch roots in N worker processes (default: {SHARDS})")
+    ap.add_argument("--vacuum", action="store_true", help="Rebuild the database once (VACUUM) to apply page_size and enable incremental vacuum")
     return ap.parse_args()
 
 # ---------------- MAIN ----------------
@@ -69,8 +89,26 @@ def main():
         print("No directories provided. Use --source and/or --media.", file=sys.stderr)
         sys.exit(2)
 
+    if args.profile:
+        profiling.enable(dump_interval=PROFILE_DUMP_INTERVAL, sample=args.profile_sample,
+                         sample_window=PROFILE_SAMPLE_WINDOW, sample_every=PROFILE_SAMPLE_EVERY,
+                         out_dir=PROFILE_DIR)
+
     print(f"[INFO] Initializing database at {db_path}")
-    db = Database(db_path)
+    index = None
+    if args.memindex:
+        from memindex import PathIndex
+        index = PathIndex()
+    db = Database(db_path, index=index)
+    if args.vacuum:
+        t0 = time.perf_counter()
+        db.vacuum()
+        print(f"[DB] VACUUM completed in {time.perf_counter() - t0:.1f}s, {db.page_stats()}")
+    maint = DBMaintainer(db, idle_seconds=DB_CHECKPOINT_IDLE, truncate_after_rows=DB_TRUNCATE_AFTER_ROWS,
+                         vacuum_freelist_pct=DB_VACUUM_FREELIST_PCT, vacuum_pages=DB_VACUUM_PAGES,
+                         interval=DB_MAINT_INTERVAL)
+    if index is not None:
+        print(f"[INFO] Loaded {len(index)} records into memory index")
     
     print(f"[INFO] Source directories: {src_dirs}")
     print(f"[INFO] Media directories: {media_dirs}")
@@ -89,20 +127,78 @@ def main():
             print(f"[INFO] Created media directory: {media_dir}")
 
     categorize = make_categorizer(src_dirs, media_dirs)
+    path_filter = build_filter()
 
-    print("[SCAN] Starting full refresh scan...")
-    try:
-        full_refresh(db, src_dirs, media_dirs, categorize)
-        print("[SCAN] Full refresh completed successfully")
-    except Exception as e:
-        print(f"[ERROR] Full refresh failed: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+    # 事件日志：存在检查点时只重放未处理的尾部，跳过全量扫描
+    journal = None
+    pending = []
+    if args.journal:
+        from journal import EventJournal
+        journal = EventJournal(os.path.expanduser(JOURNAL_PATH) if JOURNAL_PATH else db_path + ".events",
+                               fsync_interval=JOURNAL_FSYNC_INTERVAL, fsync_batch=JOURNAL_FSYNC_BATCH,
+                               checkpoint_interval=JOURNAL_CHECKPOINT_INTERVAL, compact_bytes=JOURNAL_COMPACT_BYTES)
+        pending = journal.open()
+    refresh = args.full_refresh or journal is None or not journal.has_checkpoint
+    if not refresh and not db.count_files():
+        # 数据库被删除或重建而检查点仍在：巡检只能在已有记录的目录下发现新文件，无法补齐空表
+        print("[SCAN] Index is empty, ignoring journal checkpoint")
+        refresh = True
+    elif not refresh and not args.sweep:
+        # 停机期间的变更只能由巡检补齐；关闭巡检时必须全量扫描
+        print("[SCAN] Sweeper disabled, rescanning to pick up offline changes")
+        refresh = True
+
+    pool = None
+    if args.shards > 1:
+        from shard import ShardPool
+        pool = ShardPool(src_dirs, media_dirs, args.shards, scan=refresh)
+        pool.start()
+
+    if refresh:
+        print("[SCAN] Starting full refresh scan...")
+        try:
+            if pool:
+                pool.full_refresh(db)
+            else:
+                # 扫描与 Plex 播放 / qBittorrent 做种共用磁盘：按设备限速并在延迟升高时退让
+                io = build_scheduler()
+                # 降低的优先级只作用于专用扫描线程：非 root 无法恢复 nice，且会被之后创建的线程继承
+                run_prioritized(full_refresh, db, src_dirs, media_dirs, categorize, path_filter, io,
+                                idle=IO_SCAN_IDLE, nice=IO_SCAN_NICE, name="full-refresh")
+                if io.active:
+                    print(f"[IO] Scan I/O per device: {io.stats()}")
+            print("[SCAN] Full refresh completed successfully")
+        except Exception as e:
+            print(f"[ERROR] Full refresh failed: {e}")
+            import traceback
+            traceback.print_exc()
+            if pool:
+                pool.stop()
+            sys.exit(1)
+        if journal is not None:
+            # 扫描结果已覆盖日志中的旧事件
+            journal.discard_pending()
+            pending = []
+        # 全量扫描写入大量 WAL：立即回写并截断，不等后台维护线程
+        maint.checkpoint("TRUNCATE", "after full refresh")
+    else:
+        # 停机期间发生的变更不在日志中，由后台巡检立即开始一轮补齐
+        print(f"[SCAN] Skipping full refresh: replaying {len(pending)} journaled events "
+              f"(checkpoint at seq {journal.applied}); offline changes are repaired by an immediate sweep pass")
 
     print(f"[WATCHING] Starting file watcher...")
     try:
-        observer, q, t = start_watch(db, src_dirs, media_dirs, categorize)
+        q = None
+        if journal is not None:
+            from journal import JournaledQueue
+            q = JournaledQueue(journal)
+            q.replay(pending)
+        if pool:
+            # 分片进程已在监听，这里只启动中心写入线程；ShardPool 提供与 Observer 相同的 stop/join
+            q, t = pool.start_writer(db, categorize, q, args.workers)
+            observer = pool
+        else:
+            observer, q, t = start_watch(db, src_dirs, media_dirs, categorize, path_filter, q, args.workers)
         print(f"[WATCHING] Now watching: {', '.join(src_dirs + media_dirs)}")
     except Exception as e:
         print(f"[ERROR] Failed to start watcher: {e}")
@@ -110,15 +206,38 @@ def main():
         traceback.print_exc()
         sys.exit(1)
 
+    sweeper = None
+    if args.sweep:
+        from sweeper import IntegritySweeper
+        sweep_io = build_scheduler()
+        sweep_io.add_roots(src_dirs + media_dirs)
+        sweeper = IntegritySweeper(db_path, categorize, files_per_sec=SWEEP_FILES_PER_SEC, io_pct=SWEEP_IO_PCT,
+                                   period_hours=SWEEP_PERIOD_HOURS, chunk_size=SWEEP_CHUNK_SIZE, index=index,
+                                   path_filter=path_filter, io=sweep_io, start_now=not refresh)
+        sweeper.start()
+    maint.start()
+
     # 优雅退出
     def shutdown(signum, frame):
         print("[INFO] Shutting down...")
         try:
+            if sweeper:
+                sweeper.stop()
+            maint.stop()
             observer.stop()
             observer.join(timeout=5)
         finally:
             q.put(None)
             t.join(timeout=5)
+            if journal is not None:
+                # 未处理完的事件留在日志中，下次启动时重放
+                journal.close()
+            # 刷出批量插件中尚未提交的任务并等待执行完毕
+            db.integrations.shutdown(wait=True)
+            print(f"[INFO] Upserts: {db.upsert_stats()}")
+            maint.join(timeout=5)
+            print(f"[DB] Checkpoints: {maint.stats()}")
+            profiling.disable()
             print("[INFO] Shutdown complete")
             sys.exit(0)
 
@@ -133,4 +252,6 @@ def main():
         shutdown(None, None)
 
 if __name__ == "__main__":
+    # 分片模式使用 spawn 子进程，打包后的可执行文件需要 freeze_support
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -11,6 +11,7 @@ TOKEN_FILE = os.path.expanduser("~/Media/access_token.json")  # 令牌保存文
 QUERY_BASE_URL = "http://localhost:3000/api/v1/history/transfer"
 QUERY_DETAIL_URL = "http://localhost:3000/api/v1/history/transfer"  # 详情查询URL
 DELETE_TRANSFER_URL = "http://localhost:3000/api/v1/history/transfer"  # 删除传输记录URL
+USER_INFO_URL = "http://home.hidka.com:3001/api/v1/user/admin"  # 令牌校验URL
 
 def save_token(token, expires_in=3600):
     """保存令牌到文件"""
@@ -101,7 +102,7 @@ def test_token(token):
         return False
     
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get("http://home.hidka.com:3001/api/v1/user/admin", headers=headers)
+    response = requests.get(USER_INFO_URL, headers=headers)
     return response.status_code == 200
 
 def query_transfer_history(title, page=1, count=50):
@@ -363,4 +364,45 @@ def cleanup_transfer_task(title, deletesrc=False, deletedest=False, page=1, coun
     print(f"Successfully deleted: {cleanup_result['deleted_count']} records") 
     print(f"Delete failed: {cleanup_result['failed_count']} records")
     
-    return cleanup_result
\ No newline at end of file
+    return cleanup_result
+
+def cleanup_transfer_tasks(titles, deletesrc=False, deletedest=False, count=50):
+    """批量删除整理任务：只校验一次令牌，查询各标题后统一删除"""
+    print(f"=== Starting batch cleanup: {len(titles)} titles ===")
+    
+    access_token = get_valid_token()
+    if not access_token or not test_token(access_token):
+        access_token = get_new_token()
+        if not access_token:
+            print("❌ Unable to get access token")
+            return {"success": False, "message": "Unable to get access token", "deleted_count": 0}
+    
+    # 查询所有标题，合并去重 ID
+    ids = []
+    for title in dict.fromkeys(titles):
+        result = query_transfer_history(title, 1, count)
+        if not result:
+            print(f"❌ Query failed for {title}, skipping")
+            continue
+        for transfer_id in extract_ids_from_query_result(result, title):
+            if transfer_id not in ids:
+                ids.append(transfer_id)
+    
+    deleted_ids = []
+    failed_ids = []
+    for transfer_id in ids:
+        delete_result = delete_transfer(transfer_id, deletesrc, deletedest)
+        if delete_result and delete_result.get('success', False):
+            deleted_ids.append(transfer_id)
+        else:
+            failed_ids.append(transfer_id)
+    
+    print(f"=== Batch cleanup completed: found {len(ids)}, deleted {len(deleted_ids)}, failed {len(failed_ids)} ===")
+    return {
+        "success": len(failed_ids) == 0,
+        "total_found": len(ids),
+        "deleted_count": len(deleted_ids),
+        "failed_count": len(failed_ids),
+        "deleted_ids": deleted_ids,
+        "failed_ids": failed_ids
+    }
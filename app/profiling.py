@@ -0,0 +1,246 @@
+import os
+import signal
+import threading
+import time
+from time import perf_counter_ns
+from typing import Dict, Optional
+
+# 采样模式
+SAMPLE_CPROFILE = "cprofile"
+SAMPLE_TRACEMALLOC = "tracemalloc"
+
+_BUCKETS = 64  # 按 2 的幂分桶：桶 i 覆盖 [2^(i-1), 2^i) 纳秒
+
+
+class _Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, ns: int):
+        if self.count == 0 or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+        self.count += 1
+        self.total += ns
+        self.buckets[min(ns.bit_length(), _BUCKETS - 1)] += 1
+
+    def percentile(self, pct: float) -> int:
+        # 返回所在桶的上界，精度为 2 倍以内
+        if not self.count:
+            return 0
+        target = self.count * pct / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(1 << i, self.max)
+        return self.max
+
+
+class _Stage:
+    __slots__ = ("prof", "name", "start")
+
+    def __init__(self, prof: "Profiler", name: str):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        self.prof._maybe_sample()
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.prof.record(self.name, perf_counter_ns() - self.start)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+_active: Optional["Profiler"] = None
+
+
+def stage(name: str):
+    """计时一个阶段：with profiling.stage("categorize"): ...
+
+    未启用时返回共享的空上下文，只多一次函数调用。
+    """
+    p = _active
+    return _NULL_STAGE if p is None else _Stage(p, name)
+
+
+def enabled() -> bool:
+    return _active is not None
+
+
+class Profiler:
+    def __init__(self, dump_interval: float = 300.0, sample: Optional[str] = None,
+                 sample_window: float = 30.0, sample_every: float = 0.0, out_dir: str = "."):
+        if sample not in (None, SAMPLE_CPROFILE, SAMPLE_TRACEMALLOC):
+            raise ValueError(f"Unknown profile sample mode: {sample}")
+        self.dump_interval = dump_interval
+        self.sample = sample
+        self.sample_window = sample_window
+        self.sample_every = sample_every
+        self.out_dir = os.path.abspath(os.path.expanduser(out_dir))
+        self._hist: Dict[str, _Histogram] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # 信号处理函数只置位请求，由 profiler 线程输出：信号可能打断持有 _lock 的 record()
+        self._wake = threading.Event()
+        self._dump_requested = False
+        self._window_requested = False
+        self._started_ns = perf_counter_ns()
+        # 采样窗口状态：cProfile 只能在线程内部启用，各线程在下次进入阶段时加入窗口
+        self._window_until = 0.0
+        self._window_stamp = ""
+        self._local = threading.local()
+
+    # ---- 计时 ----
+    def record(self, name: str, ns: int):
+        with self._lock:
+            h = self._hist.get(name)
+            if h is None:
+                h = self._hist[name] = _Histogram()
+            h.add(ns)
+
+    def report(self, reset: bool = False) -> str:
+        with self._lock:
+            hist = self._hist
+            if reset:
+                self._hist = {}
+        elapsed = (perf_counter_ns() - self._started_ns) / 1e9
+        lines = [f"[PROFILE] Stage timings over {elapsed:.0f}s (ms)",
+                 f"[PROFILE] {'stage':<22}{'count':>10}{'total':>12}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}"]
+        for name, h in sorted(hist.items(), key=lambda kv: -kv[1].total):
+            lines.append(
+                f"[PROFILE] {name:<22}{h.count:>10}{h.total / 1e6:>12.1f}{h.total / h.count / 1e6:>10.3f}"
+                f"{h.percentile(50) / 1e6:>10.3f}{h.percentile(99) / 1e6:>10.3f}{h.max / 1e6:>10.3f}")
+        return "\n".join(lines)
+
+    def dump(self, *_):
+        print(self.report())
+
+    def _on_dump_signal(self, *_):
+        self._dump_requested = True
+        self._wake.set()
+
+    def _on_window_signal(self, *_):
+        self._window_requested = True
+        self._wake.set()
+
+    # ---- 采样窗口 ----
+    def start_window(self, *_):
+        if not self.sample or self._window_until > time.monotonic():
+            return
+        print(f"[PROFILE] Starting {self.sample} window for {self.sample_window}s")
+        self._window_stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._window_until = time.monotonic() + self.sample_window
+        if self.sample == SAMPLE_TRACEMALLOC:
+            import tracemalloc
+            tracemalloc.start(10)
+            threading.Timer(self.sample_window, self._finish_tracemalloc).start()
+
+    def _maybe_sample(self):
+        if self.sample != SAMPLE_CPROFILE:
+            return
+        prof = getattr(self._local, "cprofile", None)
+        active = self._window_until > time.monotonic()
+        if active and prof is None:
+            import cProfile
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # Python 3.12+ 同一时刻只允许一个 cProfile，且它会覆盖所有线程
+                return
+            self._local.cprofile = prof
+        elif not active and prof is not None:
+            # 线程在窗口结束后第一次进入阶段时停止采样并写出自己的结果
+            prof.disable()
+            self._local.cprofile = None
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"cprofile-{self._window_stamp}-{threading.current_thread().name}.prof")
+            prof.dump_stats(path)
+            print(f"[PROFILE] Sample written to {path}")
+
+    def _finish_tracemalloc(self):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"tracemalloc-{self._window_stamp}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+        print(f"[PROFILE] Sample written to {path}")
+
+    # ---- 生命周期 ----
+    def start(self):
+        # 信号处理只能在主线程注册
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self._on_dump_signal)
+            signal.signal(signal.SIGUSR2, self._on_window_signal)
+
+        def loop():
+            now = time.monotonic()
+            next_dump = now + self.dump_interval if self.dump_interval else None
+            last_sample = now
+            while True:
+                deadlines = [t for t in (next_dump, last_sample + self.sample_every if self.sample_every else None)
+                             if t is not None]
+                self._wake.wait(max(0.0, min(deadlines) - time.monotonic()) if deadlines else None)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                now = time.monotonic()
+                if self._dump_requested or (next_dump is not None and now >= next_dump):
+                    self._dump_requested = False
+                    self.dump()
+                    if next_dump is not None and now >= next_dump:
+                        next_dump = now + self.dump_interval
+                if self._window_requested:
+                    self._window_requested = False
+                    self.start_window()
+                elif self.sample_every and now - last_sample >= self.sample_every:
+                    last_sample = now
+                    self.start_window()
+
+        # 即使不定期输出也要启动线程，用于响应 SIGUSR1 / SIGUSR2
+        threading.Thread(target=loop, name="profiler", daemon=True).start()
+        print(f"[PROFILE] Profiling enabled (dump every {self.dump_interval}s, SIGUSR1 to dump"
+              + (f", SIGUSR2 for {self.sample} window)" if self.sample else ")"))
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def enable(**kwargs) -> Profiler:
+    global _active
+    _active = Profiler(**kwargs)
+    _active.start()
+    return _active
+
+
+def disable():
+    global _active
+    if _active is not None:
+        _active.stop()
+        _active.dump()
+    _active = None
@@ -1,7 +1,13 @@
+import asyncio
 import requests
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
 from config import QB_URL, QB_USER, QB_PASS, QB_SIMILARITY_THRESHOLD, QB_EXCLUDE_CATEGORIES
+from config import QB_FETCH_MODE, QB_FETCH_CONCURRENCY
 
 def get_filename_from_path(path):
     return os.path.basename(path)
@@ -32,10 +38,14 @@ def calculate_similarity(str1, str2):
     return int((len(common_words) / len(total_words)) * 100)
 
 def set_file_priority(session, torrent_hash, file_index, priority=0):
-    """设置指定文件的优先级"""
+    """设置指定文件的优先级；file_index 可为多个索引，一次请求设置"""
+    if isinstance(file_index, (list, tuple, set)):
+        file_id = "|".join(str(i) for i in sorted(file_index))
+    else:
+        file_id = str(file_index)
     data = {
         "hash": torrent_hash,
-        "id": str(file_index),
+        "id": file_id,
         "priority": str(priority)
     }
     
@@ -77,84 +87,224 @@ def logout_session(session):
         print(f"Error occurred during logout: {e}")
         return False
 
+# ===== 种子文件列表获取 =====
+_batch_local = threading.local()
+
+@contextmanager
+def delete_batch():
+    """在一批删除期间按 hash 缓存种子文件列表，避免重复请求 /torrents/files。
+
+    缓存只用于文件名匹配；优先级检查（check_all_files_priority_zero）仍实时查询。
+    可嵌套，内层复用外层缓存。
+    """
+    cache = getattr(_batch_local, "files", None)
+    if cache is not None:
+        yield cache
+        return
+    _batch_local.files = {}
+    try:
+        yield _batch_local.files
+    finally:
+        _batch_local.files = None
+        runtime = getattr(_batch_local, "runtime", None)
+        _batch_local.runtime = None
+        if runtime is not None:
+            loop, executor = runtime
+            executor.shutdown(wait=False)
+            loop.close()
+
+def _batch_runtime():
+    """批量删除期间复用同一个事件循环与线程池；不在批次内时返回 None"""
+    if getattr(_batch_local, "files", None) is None:
+        return None
+    runtime = getattr(_batch_local, "runtime", None)
+    if runtime is None:
+        runtime = _batch_local.runtime = (
+            asyncio.new_event_loop(),
+            ThreadPoolExecutor(max_workers=max(1, QB_FETCH_CONCURRENCY), thread_name_prefix="qb-fetch"))
+    return runtime
+
+def _new_session():
+    # 保持少量长连接，供并发获取文件列表复用
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, QB_FETCH_CONCURRENCY))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_torrent_files(session, torrent_hash, cache=None):
+    """获取种子的文件列表；cache 为 delete_batch() 提供的按 hash 缓存"""
+    if cache is not None and torrent_hash in cache:
+        return cache[torrent_hash]
+    files_res = session.get(f"{QB_URL}/api/v2/torrents/files", params={"hash": torrent_hash})
+    files_list = files_res.json()
+    if cache is not None:
+        cache[torrent_hash] = files_list
+    return files_list
+
+def find_matching_file(files_list, target_filename, similarity_threshold):
+    """在文件列表中查找相似度达到阈值的文件，返回 (file_index, file_info, similarity) 或 None"""
+    for file_index, file_info in enumerate(files_list):
+        file_name = get_filename_from_path(file_info['name'])
+        
+        # 使用自定义的相似度计算检查文件名相似度
+        similarity = calculate_similarity(target_filename, file_name)
+        if similarity >= similarity_threshold:
+            return file_index, file_info, similarity
+    return None
+
+def _search_sequential(session, hashes, target_filename, similarity_threshold, cache):
+    # 遍历每个hash，获取对应的文件列表
+    for torrent_hash in hashes:
+        print(f"Checking hash: {torrent_hash}")
+        match = find_matching_file(fetch_torrent_files(session, torrent_hash, cache), target_filename, similarity_threshold)
+        if match:
+            return torrent_hash, match
+    return None
+
+async def _search_async(session, hashes, target_filename, similarity_threshold, cache, concurrency, executor):
+    # 用信号量限制并发，请求在线程池中执行以复用 requests 的连接池。
+    # 结果与顺序模式一致：返回列表中最靠前的匹配种子（交叉辅种时同名文件可能出现在多个种子里）；
+    # 某个种子匹配后只取消排在它之后的请求，排在前面的仍需等待完成
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(torrent_hash):
+        async with sem:
+            return await loop.run_in_executor(executor, fetch_torrent_files, session, torrent_hash, cache)
+
+    tasks = [asyncio.ensure_future(fetch(h)) for h in hashes]
+    index = {t: i for i, t in enumerate(tasks)}
+    results = {}   # 列表下标 -> 文件列表或异常
+    matches = {}   # 列表下标 -> 匹配结果
+    pending = set(tasks)
+    next_idx = 0
+    try:
+        while True:
+            # 按列表顺序消费已完成的结果
+            while next_idx in results:
+                r = results[next_idx]
+                if isinstance(r, BaseException):
+                    raise r
+                if next_idx in matches:
+                    return hashes[next_idx], matches[next_idx]
+                next_idx += 1
+            if next_idx >= len(tasks) or not pending:
+                return None
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                i = index[t]
+                if t.cancelled():
+                    continue
+                r = results[i] = t.exception() or t.result()
+                if isinstance(r, BaseException):
+                    continue
+                match = find_matching_file(r, target_filename, similarity_threshold)
+                if match:
+                    matches[i] = match
+                    # 排在该匹配之后的种子不可能再被选中
+                    for later in list(pending):
+                        if index[later] > i:
+                            later.cancel()
+                            pending.discard(later)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def search_torrents(session, hashes, target_filename, similarity_threshold):
+    """在给定种子中查找匹配文件，返回 (torrent_hash, (file_index, file_info, similarity)) 或 None"""
+    # 批量删除期间缓存位于当前线程，传给线程池前先取出
+    cache = getattr(_batch_local, "files", None)
+    if QB_FETCH_MODE == "async" and len(hashes) > 1:
+        print(f"Fetching file lists for {len(hashes)} torrents (concurrency={QB_FETCH_CONCURRENCY})")
+        concurrency = max(1, QB_FETCH_CONCURRENCY)
+        runtime = _batch_runtime()
+        if runtime is not None:
+            loop, executor = runtime
+            return loop.run_until_complete(_search_async(session, hashes, target_filename, similarity_threshold,
+                                                         cache, concurrency, executor))
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="qb-fetch")
+        try:
+            return asyncio.run(_search_async(session, hashes, target_filename, similarity_threshold, cache,
+                                             concurrency, executor))
+        finally:
+            executor.shutdown(wait=False)
+    return _search_sequential(session, hashes, target_filename, similarity_threshold, cache)
+
+def login(session):
+    # 登录
+    login_data = {
+        "username": QB_USER,
+        "password": QB_PASS
+    }
+    r = session.post(f"{QB_URL}/api/v2/auth/login", data=login_data)
+    if r.text != "Ok.":
+        raise Exception("Failed to login to qBittorrent, please check username and password")
+
+def list_candidate_hashes(session):
+    """获取所有任务，过滤掉排除分类后返回 hash 列表"""
+    torrents = session.get(f"{QB_URL}/api/v2/torrents/info").json()
+    
+    # 过滤掉指定分类的种子
+    filtered_torrents = []
+    for torrent in torrents:
+        category = torrent.get('category', '')
+        if category not in QB_EXCLUDE_CATEGORIES:
+            filtered_torrents.append(torrent)
+        else:
+            print(f"Skipping {category} torrent: {torrent.get('name', 'Unknown')}")
+    
+    # 获取过滤后的hash列表
+    all_hashes = [torrent['hash'] for torrent in filtered_torrents]
+    print(f"Found {len(all_hashes)} non-excluded torrent hashes (excluded {len(torrents) - len(filtered_torrents)} torrents)")
+    return all_hashes
+
 # ===== 获取 torrent hash =====
 def get_torrent_hash_from_file(file_path, similarity_threshold=None):
     # 如果没有传入相似度阈值，使用配置文件中的默认值
     if similarity_threshold is None:
         similarity_threshold = QB_SIMILARITY_THRESHOLD
         
-    session = requests.Session()
+    session = _new_session()
 
     try:
-        # 登录
-        login_data = {
-            "username": QB_USER,
-            "password": QB_PASS
-        }
-        r = session.post(f"{QB_URL}/api/v2/auth/login", data=login_data)
-        if r.text != "Ok.":
-            raise Exception("Failed to login to qBittorrent, please check username and password")
+        login(session)
 
         target_filename = get_filename_from_path(file_path)
 
-        # 获取所有任务
-        torrents = session.get(f"{QB_URL}/api/v2/torrents/info").json()
-        
-        # 过滤掉指定分类的种子
-        filtered_torrents = []
-        for torrent in torrents:
-            category = torrent.get('category', '')
-            if category not in QB_EXCLUDE_CATEGORIES:
-                filtered_torrents.append(torrent)
-            else:
-                print(f"Skipping {category} torrent: {torrent.get('name', 'Unknown')}")
-        
-        # 获取过滤后的hash列表
-        all_hashes = [torrent['hash'] for torrent in filtered_torrents]
-        print(f"Found {len(all_hashes)} non-excluded torrent hashes (excluded {len(torrents) - len(filtered_torrents)} torrents)")
+        all_hashes = list_candidate_hashes(session)
 
-        # 遍历每个hash，获取对应的文件列表
-        for torrent_hash in all_hashes:
-            print(f"Checking hash: {torrent_hash}")
+        found = search_torrents(session, all_hashes, target_filename, similarity_threshold)
+        if found:
+            torrent_hash, (file_index, file_info, similarity) = found
+            print(f"Found matching file: {file_info['name']} (similarity: {similarity}%)")
+            print(f"File index: {file_index}")
             
-            # 获取该hash对应的文件列表
-            files_res = session.get(f"{QB_URL}/api/v2/torrents/files", params={"hash": torrent_hash})
-            files_list = files_res.json()
-
-            # 检查文件列表中是否有匹配的文件
-            for file_index, file_info in enumerate(files_list):
-                file_name = get_filename_from_path(file_info['name'])
+            # 设置文件优先级为0（不下载）
+            if set_file_priority(session, torrent_hash, file_index, priority=0):
+                print("Successfully set file priority to 0 (do not download)")
                 
-                # 使用自定义的相似度计算检查文件名相似度
-                similarity = calculate_similarity(target_filename, file_name)
-                if similarity >= similarity_threshold:
-                    print(f"Found matching file: {file_info['name']} (similarity: {similarity}%)")
-                    print(f"File index: {file_index}")
-                    
-                    # 设置文件优先级为0（不下载）
-                    if set_file_priority(session, torrent_hash, file_index, priority=0):
-                        print("Successfully set file priority to 0 (do not download)")
-                        
-                        # 检查该种子中所有文件的优先级是否都为0
-                        print("Checking priority of all files in torrent...")
-                        if check_all_files_priority_zero(session, torrent_hash):
-                            print("All files have priority 0, preparing to delete torrent...")
-                            if delete_torrent(session, torrent_hash, delete_files=False):
-                                print("Torrent successfully deleted")
-                                logout_session(session)
-                                return torrent_hash, file_index, True  # True表示已删除种子
-                            else:
-                                print("Failed to delete torrent")
-                                logout_session(session)
-                                return torrent_hash, file_index, False
-                        else:
-                            print("Other files in torrent still need downloading, keeping torrent")
-                            logout_session(session)
-                            return torrent_hash, file_index, False
+                # 检查该种子中所有文件的优先级是否都为0
+                print("Checking priority of all files in torrent...")
+                if check_all_files_priority_zero(session, torrent_hash):
+                    print("All files have priority 0, preparing to delete torrent...")
+                    if delete_torrent(session, torrent_hash, delete_files=False):
+                        print("Torrent successfully deleted")
+                        logout_session(session)
+                        return torrent_hash, file_index, True  # True表示已删除种子
                     else:
-                        print("Failed to set file priority")
+                        print("Failed to delete torrent")
                         logout_session(session)
                         return torrent_hash, file_index, False
+                else:
+                    print("Other files in torrent still need downloading, keeping torrent")
+                    logout_session(session)
+                    return torrent_hash, file_index, False
+            else:
+                print("Failed to set file priority")
+                logout_session(session)
+                return torrent_hash, file_index, False
 
         # 没有找到匹配文件
         logout_session(session)
@@ -164,3 +314,55 @@ def get_torrent_hash_from_file(file_path, similarity_threshold=None):
         print(f"Error occurred during operation: {e}")
         logout_session(session)
         raise
+
+
+# ===== 批量处理 =====
+def process_files_batch(file_paths, similarity_threshold=None):
+    """批量处理一组被删除的源文件。
+
+    只登录一次、获取一次种子列表，按种子分组后每个种子只调用一次 filePrio
+    （多个文件索引），所有文件优先级为 0 时至多删除一次种子。
+    返回 {torrent_hash: ([file_index, ...], torrent_deleted)}。
+    """
+    if similarity_threshold is None:
+        similarity_threshold = QB_SIMILARITY_THRESHOLD
+
+    session = _new_session()
+    try:
+        login(session)
+        all_hashes = list_candidate_hashes(session)
+
+        groups = {}
+        with delete_batch():
+            for file_path in file_paths:
+                target_filename = get_filename_from_path(file_path)
+                found = search_torrents(session, all_hashes, target_filename, similarity_threshold)
+                if not found:
+                    print(f"No matching torrent found for file: {target_filename}")
+                    continue
+                torrent_hash, (file_index, file_info, similarity) = found
+                print(f"Found matching file: {file_info['name']} (similarity: {similarity}%)")
+                groups.setdefault(torrent_hash, set()).add(file_index)
+
+        results = {}
+        for torrent_hash, indexes in groups.items():
+            indexes = sorted(indexes)
+            if not set_file_priority(session, torrent_hash, indexes, priority=0):
+                print(f"Failed to set file priority for {torrent_hash}")
+                results[torrent_hash] = (indexes, False)
+                continue
+            print(f"Set priority 0 for {len(indexes)} files in {torrent_hash}")
+            deleted = False
+            if check_all_files_priority_zero(session, torrent_hash):
+                print("All files have priority 0, preparing to delete torrent...")
+                deleted = delete_torrent(session, torrent_hash, delete_files=False)
+                print("Torrent successfully deleted" if deleted else "Failed to delete torrent")
+            results[torrent_hash] = (indexes, deleted)
+
+        logout_session(session)
+        return results
+
+    except Exception as e:
+        print(f"Error occurred during operation: {e}")
+        logout_session(session)
+        raise
@@ -1,44 +1,98 @@
 import os
-from typing import Callable, Iterable
-from db import Database  # 修改为绝对导入
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+from db import Database, SQL_BATCH  # 修改为绝对导入
+from filters import PathFilter
+from iothrottle import IOScheduler
+import profiling
 
-def default_should_include(path: str) -> bool:
-    # 仅索引常规文件
-    return os.path.isfile(path)
+def _walk(root: str, path_filter: Optional[PathFilter], io: Optional[IOScheduler], dev: int) -> Iterator[os.DirEntry]:
+    # 基于 scandir 的遍历：被剪除的目录不会进入，文件名规则在 stat 之前判断
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            if io is None:
+                with os.scandir(d) as it:
+                    entries = list(it)
+            else:
+                with io.op(IOScheduler.DIR, dev=dev):
+                    with os.scandir(d) as it:
+                        entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if path_filter is None or not path_filter.prune_dir(entry.name):
+                    stack.append(entry.path)
+            elif path_filter is None or path_filter.include_name(entry.name):
+                yield entry
 
-def full_refresh(db: Database, roots_source: Iterable[str], roots_media: Iterable[str], categorize: Callable[[str], str]):
+def iter_files(roots: Iterable[str], categorize: Callable[[str], str],
+               path_filter: Optional[PathFilter] = None,
+               io: Optional[IOScheduler] = None) -> Iterator[Tuple[str, str, os.stat_result]]:
+    # 遍历根目录，产出 (路径, 分类, lstat 结果)；全量扫描与分片进程共用
+    for root in roots:
+        print(f"[SCAN] Scanning directory: {root}")
+        if not os.path.exists(root):
+            print(f"[SCAN] Directory does not exist, skipping: {root}")
+            continue
+        dev = os.stat(root).st_dev
+            
+        for entry in _walk(root, path_filter, io, dev):
+            # 仅索引常规文件（与 os.path.isfile 一致，跟随符号链接；d_type 可用时无需 stat）
+            with profiling.stage("scan.isfile"):
+                include = entry.is_file()
+            if not include:
+                continue
+            fpath = entry.path
+            with profiling.stage("scan.categorize"):
+                cat = categorize(fpath)
+            if not cat:
+                continue
+            try:
+                with profiling.stage("stat"):
+                    if io is None:
+                        st = entry.stat(follow_symlinks=False)
+                    else:
+                        with io.op(IOScheduler.STAT, dev=dev):
+                            st = entry.stat(follow_symlinks=False)
+            except OSError:
+                # 扫描过程中可能被删除，忽略
+                continue
+            if path_filter is not None and not path_filter.include_size(st.st_size):
+                continue
+            yield fpath, cat, st
+
+def full_refresh(db: Database, roots_source: Iterable[str], roots_media: Iterable[str], categorize: Callable[[str], str],
+                 path_filter: Optional[PathFilter] = None, io: Optional[IOScheduler] = None):
     print("[SCAN] Starting database refresh...")
+    before = db.upsert_stats()
     with db.tx():
-        db.clear_all()
-        print("[SCAN] Database cleared")
+        # 标记-清除：只写入有变化的行，最后删除扫描中未出现的行
+        db.begin_scan()
         
         roots = list(set(list(roots_source) + list(roots_media)))
         file_count = 0
+        seen = []
         
-        for root in roots:
-            print(f"[SCAN] Scanning directory: {root}")
-            if not os.path.exists(root):
-                print(f"[SCAN] Directory does not exist, skipping: {root}")
-                continue
-                
-            for dirpath, dirnames, filenames in os.walk(root, followlinks=False):
-                # 可按需过滤目录/文件
-                for name in filenames:
-                    fpath = os.path.join(dirpath, name)
-                    if not default_should_include(fpath):
-                        continue
-                    cat = categorize(fpath)
-                    if not cat:
-                        continue
-                    try:
-                        db.handle_create_or_modify(fpath, cat)
-                        file_count += 1
-                        if file_count % 100 == 0:  # 每100个文件输出一次进度
-                            print(f"[SCAN] Processed {file_count} files...")
-                    except FileNotFoundError:
-                        # 扫描过程中可能被删除，忽略
-                        pass
-                    except Exception as e:
-                        print(f"[SCAN] Error processing {fpath}: {e}")
+        for fpath, cat, st in iter_files(roots, categorize, path_filter, io):
+            try:
+                with profiling.stage("scan.upsert"):
+                    db.upsert_row(fpath, cat, st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+                seen.append(fpath)
+                if len(seen) >= SQL_BATCH:
+                    db.mark_seen(seen)
+                    seen = []
+                file_count += 1
+                if file_count % 100 == 0:  # 每100个文件输出一次进度
+                    print(f"[SCAN] Processed {file_count} files...")
+            except Exception as e:
+                print(f"[SCAN] Error processing {fpath}: {e}")
+        db.mark_seen(seen)
+        removed = db.finish_scan()
         
-        print(f"[SCAN] Completed. Total files processed: {file_count}")
+        after = db.upsert_stats()
+        written = after["written"] - before["written"]
+        skipped = after["skipped"] - before["skipped"]
+        print(f"[SCAN] Completed. Total files processed: {file_count} "
+              f"(written {written}, unchanged {skipped}, removed {removed})")
@@ -0,0 +1,233 @@
+import os
+import queue
+import signal
+import threading
+import time
+import multiprocessing as mp
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import Database
+
+# 分片进程 -> 中心写入线程 的消息类型（监听事件沿用 watcher 的 create/modify/move/delete）
+MSG_ROWS = "scan_rows"   # ("scan_rows", shard_id, [(path, category, dev, ino, size, mtime), ...])
+MSG_DONE = "scan_done"   # ("scan_done", shard_id, file_count)
+
+
+def assign_shards(roots: List[str], shards: int) -> List[List[str]]:
+    """把根目录分配到各分片。
+
+    同一设备（st_dev，即同一块盘）上的根目录放进同一分片，避免多个进程争抢
+    同一块磁盘的寻道；设备组按根目录数降序贪心分配给当前最空的分片。
+    """
+    by_dev: Dict[int, List[str]] = {}
+    for r in sorted(roots):
+        try:
+            dev = os.stat(r).st_dev
+        except OSError:
+            dev = -1
+        by_dev.setdefault(dev, []).append(r)
+
+    buckets: List[List[str]] = [[] for _ in range(max(1, shards))]
+    for group in sorted(by_dev.values(), key=len, reverse=True):
+        min(buckets, key=len).extend(group)
+    return [b for b in buckets if b]
+
+
+def _shard_main(shard_id: int, roots: List[str], src_dirs: List[str], media_dirs: List[str],
+                out_q, stop_evt, batch_size: int, scan: bool = True):
+    # 子进程：忽略 Ctrl+C，由主进程通过 stop_evt 统一停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from watchdog.observers import Observer
+    from config import IO_SCAN_IDLE, IO_SCAN_NICE
+    from filters import build_filter
+    from iothrottle import build_scheduler, run_prioritized
+    from main import make_categorizer
+    from scanner import iter_files
+    from watcher import _Handler
+
+    # 过滤规则在子进程内按 config 重新编译（编译后的正则不跨进程传递）
+    path_filter = build_filter()
+    categorize = make_categorizer(src_dirs, media_dirs)
+
+    # 先开始监听再扫描：扫描期间产生的事件由中心写入线程在刷新提交后再处理
+    observer = Observer()
+    handler = _Handler(out_q, path_filter)
+    for r in roots:
+        if os.path.isdir(r):
+            observer.schedule(handler, r, recursive=True)
+    observer.start()
+    print(f"[SHARD {shard_id}] Watching {len(roots)} roots: {', '.join(roots)}")
+
+    def scan_roots() -> int:
+        count = 0
+        batch = []
+        for fpath, cat, st in iter_files(roots, categorize, path_filter, build_scheduler()):
+            batch.append((fpath, cat, st.st_dev, st.st_ino, st.st_size, st.st_mtime))
+            if len(batch) >= batch_size:
+                out_q.put((MSG_ROWS, shard_id, batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            out_q.put((MSG_ROWS, shard_id, batch))
+            count += len(batch)
+        return count
+
+    file_count = 0
+    try:
+        # scan=False：主进程从事件日志恢复，跳过全量扫描；降低的优先级只作用于扫描线程
+        if scan:
+            file_count = run_prioritized(scan_roots, idle=IO_SCAN_IDLE, nice=IO_SCAN_NICE,
+                                         name=f"shard-{shard_id}-scan")
+    except Exception as e:
+        print(f"[SHARD {shard_id}] Scan failed: {e}")
+    finally:
+        out_q.put((MSG_DONE, shard_id, file_count))
+
+    try:
+        while not stop_evt.wait(1):
+            pass
+    finally:
+        observer.stop()
+        observer.join(timeout=5)
+        print(f"[SHARD {shard_id}] Stopped")
+
+
+class ShardPool:
+    """多进程分片模式：每个分片进程负责一组根目录的扫描与监听，
+    所有结果经 multiprocessing 队列汇总到主进程中唯一的写入线程。
+
+    数据库只由主进程写入，因此 handle_delete 的硬链接级联始终能看到
+    所有分片的记录，跨分片的 source/media 硬链接也能正确清理。
+    """
+
+    def __init__(self, src_dirs: List[str], media_dirs: List[str], shards: int, batch_size: int = 500,
+                 scan: bool = True):
+        roots = list(set(list(src_dirs) + list(media_dirs)))
+        self.assignments = assign_shards(roots, shards)
+        self.src_dirs = list(src_dirs)
+        self.media_dirs = list(media_dirs)
+        self.batch_size = batch_size
+        self._ctx = mp.get_context("spawn")
+        # 有界队列：写入跟不上时对分片进程形成背压
+        self.out_q = self._ctx.Queue(maxsize=256)
+        self.stop_evt = self._ctx.Event()
+        self.procs = [self._spawn(i, scan) for i in range(len(self.assignments))]
+        self._held: List[tuple] = []
+        self._forwarder = None
+        # 分片重启的退避：shard_id -> (下次允许重启的时间, 当前退避秒数)
+        self._backoff: Dict[int, Tuple[float, float]] = {}
+
+    def _spawn(self, i: int, scan: bool):
+        return self._ctx.Process(target=_shard_main, name=f"shard-{i}", daemon=True,
+                                 args=(i, self.assignments[i], self.src_dirs, self.media_dirs,
+                                       self.out_q, self.stop_evt, self.batch_size, scan))
+
+    def start(self):
+        print(f"[SHARD] Starting {len(self.procs)} shard processes")
+        for p in self.procs:
+            p.start()
+
+    def full_refresh(self, db: Database):
+        """消费各分片的扫描结果，在一个事务内重建索引。"""
+        print("[SCAN] Starting sharded database refresh...")
+        pending = set(range(len(self.procs)))
+        file_count = 0
+        before = db.upsert_stats()
+        with db.tx():
+            # 标记-清除：未变化的行不重写，扫描结束后删除未出现的行
+            db.begin_scan()
+            failed = False
+            next_check = time.monotonic() + 1
+            while pending:
+                # 按时间检查存活：其它分片持续发送监听事件时 get() 不会超时
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + 1
+                    for i in list(pending):
+                        if not self.procs[i].is_alive():
+                            print(f"[SHARD {i}] Process exited before finishing scan")
+                            pending.discard(i)
+                            failed = True
+                    if not pending:
+                        break
+                try:
+                    msg = self.out_q.get(timeout=1)
+                except queue.Empty:
+                    continue
+                kind = msg[0]
+                if kind == MSG_ROWS:
+                    db.upsert_rows(msg[2])
+                    db.mark_seen([r[0] for r in msg[2]])
+                    file_count += len(msg[2])
+                    print(f"[SCAN] Processed {file_count} files...")
+                elif kind == MSG_DONE:
+                    print(f"[SHARD {msg[1]}] Scan completed ({msg[2]} files)")
+                    pending.discard(msg[1])
+                else:
+                    # 扫描期间的监听事件，待刷新提交后再处理
+                    self._held.append(msg)
+            if failed:
+                # 有分片未扫完，无法判断哪些行已失效，保留现有记录交给巡检
+                removed = 0
+                db.finish_scan_keep()
+            else:
+                removed = db.finish_scan()
+        after = db.upsert_stats()
+        print(f"[SCAN] Completed. Total files processed: {file_count} "
+              f"(written {after['written'] - before['written']}, "
+              f"unchanged {after['skipped'] - before['skipped']}, removed {removed})")
+
+    def start_writer(self, db: Database, categorize: Callable[[str], str], q: Optional[queue.Queue] = None,
+                     workers: int = 1):
+        """启动中心写入：转发线程把分片事件放入本地队列，由 watcher 的 worker 池处理。"""
+        from watcher import start_workers
+
+        if q is None:
+            q = queue.Queue()
+        for item in self._held:
+            q.put(item)
+        self._held = []
+
+        def forward():
+            next_check = time.monotonic() + 1
+            while not self.stop_evt.is_set():
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + 1
+                    self._restart_dead()
+                try:
+                    msg = self.out_q.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if msg[0] in (MSG_ROWS, MSG_DONE):
+                    continue
+                q.put(msg)
+
+        self._forwarder = threading.Thread(target=forward, daemon=True)
+        self._forwarder.start()
+        t = start_workers(db, categorize, q, workers)
+        return q, t
+
+    def _restart_dead(self):
+        # 监听阶段退出的分片重新拉起（只监听，不扫描）；停机期间漏掉的变更由巡检补齐
+        now = time.monotonic()
+        for i, p in enumerate(self.procs):
+            if p.is_alive() or self.stop_evt.is_set():
+                continue
+            at, delay = self._backoff.get(i, (0.0, 1.0))
+            if now < at:
+                continue
+            print(f"[SHARD {i}] Process exited (code {p.exitcode}), restarting watch of: "
+                  f"{', '.join(self.assignments[i])}")
+            self.procs[i] = self._spawn(i, scan=False)
+            self.procs[i].start()
+            # 反复崩溃时逐步拉长重启间隔，最长 60 秒
+            self._backoff[i] = (now + delay, min(delay * 2, 60.0))
+
+    # 与 watchdog Observer 相同的停止接口，便于 main.shutdown 复用
+    def stop(self):
+        self.stop_evt.set()
+
+    def join(self, timeout=None):
+        for p in self.procs:
+            p.join(timeout=timeout)
+        if self._forwarder is not None:
+            self._forwarder.join(timeout=timeout)
@@ -0,0 +1,264 @@
+import os
+import stat
+import threading
+import time
+from typing import Callable, Optional, Set
+
+from config import IO_SWEEP_IDLE
+from db import Database
+from filters import PathFilter
+from iothrottle import IOScheduler, io_priority
+from integrations import IntegrationRegistry
+from memindex import PathIndex
+import profiling
+
+META_CURSOR = "sweep_cursor"          # 上次处理到的 path
+META_PASS_START = "sweep_pass_start"  # 本轮开始时间（epoch 秒）
+
+
+class _Budget:
+    """巡检的 I/O 预算：files_per_sec 限制速率，io_pct 限制 I/O 时间占比。"""
+
+    def __init__(self, files_per_sec: float, io_pct: Optional[float], stop: threading.Event):
+        self.set_rate(files_per_sec)
+        self.io_pct = io_pct
+        self.stop = stop
+        self._next = time.monotonic()
+        self._io = 0.0  # 上一次 I/O 的耗时，在下一次 I/O 之前偿还
+
+    def set_rate(self, files_per_sec: float):
+        self.interval = 1.0 / files_per_sec if files_per_sec > 0 else 0.0
+
+    def wait(self):
+        # 在 I/O 之前休眠（而不是之后），stat 结果到写库之间没有停顿，不会用过期的 stat 写库
+        # 两种限制取较严格者；用 Event.wait 休眠以便及时响应停止
+        delay = max(0.0, self._next - time.monotonic())
+        if self.io_pct and 0 < self.io_pct < 100:
+            delay = max(delay, self._io * (100.0 / self.io_pct - 1.0))
+        self._io = 0.0
+        self._next = time.monotonic() + delay + self.interval
+        if delay:
+            self.stop.wait(delay)
+
+    def charge(self, io_seconds: float):
+        self._io += io_seconds
+
+
+class IntegritySweeper:
+    """低优先级后台巡检：分批核对 files 表与磁盘，原地修复漂移。
+
+    - 按 path 做 keyset 分页，游标保存在 meta 表中，重启后从断点继续；
+    - 每个路径 lstat 一次：不存在 / 非常规文件 / 超出监听范围的行被删除，
+      dev/ino/size/mtime 变化的行被重写；
+    - 对本轮首次遇到的目录及其上级目录做一次 scandir，补录缺失的文件与尚未入库的子目录；
+    - 每轮按 索引文件数 / period_hours 推算速率（留 20% 余量），不超过 files_per_sec 与
+      io_pct 预算；预算不足以在一个周期内覆盖全部索引时在开始与结束时告警；
+    - 一轮结束后等待到 period_hours 再开始下一轮。
+
+    只修复索引，不触发删除联动（不会删除源文件，也不调用 qBittorrent/MoviePilot）。
+    使用独立的数据库连接，借助 WAL 与 watcher 并发。
+    """
+
+    def __init__(self, db_path: str, categorize: Callable[[str], str], files_per_sec: float = 20.0,
+                 io_pct: Optional[float] = None, period_hours: float = 24.0, chunk_size: int = 200,
+                 index: Optional[PathIndex] = None, path_filter: Optional[PathFilter] = None,
+                 io: Optional[IOScheduler] = None, start_now: bool = False):
+        self.db_path = db_path
+        # 启动时跳过了全量扫描：立即从头开始一轮补齐停机期间的变更，不等 period 到期
+        self.start_now = start_now
+        self.path_filter = path_filter
+        self.index = index  # 与主连接共享的内存镜像，修复时同步更新
+        self.categorize = categorize
+        self.files_per_sec = files_per_sec
+        self.io_pct = io_pct
+        self.period = period_hours * 3600
+        self.chunk_size = chunk_size
+        self._stop = threading.Event()
+        # 按设备的限速与自适应退让，与 _Budget 的总体速率限制叠加
+        self.io = io if io is not None else IOScheduler(adaptive=False)
+        self.io.stop = self._stop
+        self._thread: Optional[threading.Thread] = None
+        self.checked = 0
+        self.repaired = 0
+
+    # ---- 生命周期 ----
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        # nice 19 + ioprio IDLE：只作用于巡检线程
+        with io_priority(IO_SWEEP_IDLE, 19):
+            self._run_loop()
+
+    def _run_loop(self):
+        self.db = Database(self.db_path, IntegrationRegistry(), index=self.index)
+        self.budget = _Budget(self.files_per_sec, self.io_pct, self._stop)
+        print(f"[SWEEP] Integrity sweeper started (up to {self.files_per_sec} files/s"
+              + (f", {self.io_pct}% IO" if self.io_pct else "") + f", every {self.period / 3600:g}h)")
+        while not self._stop.is_set():
+            try:
+                self.sweep_pass()
+            except Exception as e:
+                print(f"[SWEEP] Error during sweep: {e}")
+                self._stop.wait(60)
+        print("[SWEEP] Integrity sweeper stopped")
+
+    # ---- 巡检 ----
+    def sweep_pass(self):
+        cursor = self.db.get_meta(META_CURSOR, "")
+        pass_start = float(self.db.get_meta(META_PASS_START, "0"))
+        catch_up = self.start_now
+        if self.start_now:
+            self.start_now = False
+            print("[SWEEP] Catch-up pass for changes made while stopped, starting now")
+            # 未完成的一轮也从头开始：游标之前的路径同样可能在停机期间变化
+            cursor = ""
+            pass_start = 0.0
+        if not cursor:
+            # 新一轮：距离上一轮开始不足 period 则等待
+            wait = pass_start + self.period - time.time()
+            if wait > 0 and self._stop.wait(wait):
+                return
+            pass_start = time.time()
+            self.db.set_meta(META_PASS_START, str(pass_start))
+            self.checked = self.repaired = 0
+        total = self.db.count_files()
+        rate = self._pass_rate(total, catch_up)
+        self.budget.set_rate(rate)
+        if not cursor:
+            print(f"[SWEEP] Starting pass over {total} indexed files"
+                  + (f" at {rate:.1f} files/s" if rate > 0 else ""))
+
+        seen_dirs: Set[str] = set()
+        while not self._stop.is_set():
+            paths = self.db.iter_paths_after(cursor, self.chunk_size)
+            if not paths:
+                break
+            for path in paths:
+                if self._stop.is_set():
+                    return
+                self._check_path(path)
+                # 所在目录及其上级目录（直到监听根）每轮各检查一次
+                d = os.path.dirname(path)
+                while d not in seen_dirs and self.categorize(d):
+                    seen_dirs.add(d)
+                    self._check_dir(d, seen_dirs)
+                    d = os.path.dirname(d)
+            cursor = paths[-1]
+            self.db.set_meta(META_CURSOR, cursor)
+
+        if not self._stop.is_set():
+            self.db.set_meta(META_CURSOR, "")
+            elapsed = time.time() - pass_start
+            print(f"[SWEEP] Pass completed in {elapsed:.0f}s: "
+                  f"checked {self.checked}, repaired {self.repaired}")
+            if elapsed > self.period and not catch_up:
+                print(f"[SWEEP] Pass overran its {self.period / 3600:g}h period by {(elapsed - self.period) / 3600:.1f}h; "
+                      f"raise SWEEP_FILES_PER_SEC / SWEEP_IO_PCT or SWEEP_PERIOD_HOURS")
+
+    def _pass_rate(self, total: int, catch_up: bool) -> float:
+        # 补齐轮按预算全速；常规轮只用覆盖整个索引所需的速率，把 I/O 均摊到整个周期
+        if self.files_per_sec <= 0 or catch_up:
+            return self.files_per_sec
+        needed = total / self.period if self.period > 0 else self.files_per_sec
+        if needed > self.files_per_sec:
+            print(f"[SWEEP] {total} files at {self.files_per_sec:g} files/s need "
+                  f"{total / self.files_per_sec / 3600:.1f}h per pass, longer than the {self.period / 3600:g}h period")
+        return min(self.files_per_sec, max(1.0, needed * 1.2))
+
+    def _lstat(self, path: str):
+        self.budget.wait()
+        t0 = time.monotonic()
+        try:
+            with profiling.stage("sweep.stat"), self.io.op(IOScheduler.STAT, path):
+                return os.lstat(path)
+        except FileNotFoundError:
+            return None
+        finally:
+            self.budget.charge(time.monotonic() - t0)
+
+    @staticmethod
+    def _is_file(path: str, st: os.stat_result) -> bool:
+        # 与扫描一致：指向常规文件的符号链接也入库（记录链接自身的 lstat）
+        if stat.S_ISREG(st.st_mode):
+            return True
+        return stat.S_ISLNK(st.st_mode) and os.path.isfile(path)
+
+    def _included(self, path: str, st: os.stat_result) -> bool:
+        # 过滤规则变更后，已被排除的行（含小于 SCAN_MIN_SIZE 的文件）按失效记录删除
+        return self.path_filter is None or (self.path_filter.include_path(path)
+                                            and self.path_filter.include_size(st.st_size))
+
+    def _check_path(self, path: str):
+        self.checked += 1
+        rows = self.db.get_all_by_path(path)
+        st = self._lstat(path)
+        cat = self.categorize(path) if st is not None and self._included(path, st) else None
+        if st is None or not self._is_file(path, st) or not cat:
+            with self.db.tx(rollback_paths=[path]):
+                # 期间 watcher 可能已按重新创建的文件写入了新记录，不能删掉它
+                if st is None and os.path.lexists(path):
+                    return
+                print(f"[SWEEP] Removing stale row: {path}")
+                self.db.delete_by_path(path)
+            self.repaired += 1
+            return
+        if len(rows) == 1:
+            r = rows[0]
+            if (r["dev"], r["ino"], r["size"], r["mtime"], r["category"]) == \
+                    (st.st_dev, st.st_ino, st.st_size, st.st_mtime, cat):
+                return
+        # 与主连接共享内存镜像：回滚时只恢复本路径，不从巡检连接整体重新加载
+        with self.db.tx(rollback_paths=[path]):
+            # 期间 watcher 可能已处理了删除事件，不能用旧的 stat 把记录加回来
+            if not os.path.lexists(path):
+                return
+            print(f"[SWEEP] Refreshing stale row: {path}")
+            self.db.delete_by_path(path)
+            self.db.upsert_row(path, cat, st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        self.repaired += 1
+
+    def _check_dir(self, dirpath: str, seen_dirs: Set[str]):
+        # 补录目录中未入库的文件；完全没有记录的子目录整体补录
+        self.budget.wait()
+        t0 = time.monotonic()
+        try:
+            with self.io.op(IOScheduler.DIR, dirpath):
+                entries = list(os.scandir(dirpath))
+        except OSError:
+            return
+        finally:
+            self.budget.charge(time.monotonic() - t0)
+        for entry in entries:
+            if self._stop.is_set():
+                return
+            if entry.is_dir(follow_symlinks=False):
+                if self.path_filter is not None and self.path_filter.prune_dir(entry.name):
+                    continue
+                if entry.path not in seen_dirs and not self.db.has_rows_under(entry.path):
+                    seen_dirs.add(entry.path)
+                    self._check_dir(entry.path, seen_dirs)
+            elif entry.is_file():
+                if self.path_filter is not None and not self.path_filter.include_name(entry.name):
+                    continue
+                if self.db.get_by_path(entry.path) is not None:
+                    continue
+                cat = self.categorize(entry.path)
+                st = self._lstat(entry.path) if cat else None
+                if st is None:
+                    continue
+                if self.path_filter is not None and not self.path_filter.include_size(st.st_size):
+                    continue
+                if not os.path.lexists(entry.path):
+                    continue
+                print(f"[SWEEP] Adding missing row: {entry.path}")
+                self.db.upsert_row(entry.path, cat, st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+                self.repaired += 1
@@ -1,86 +1,300 @@
 import os
 import threading
+import time
 import queue
-from typing import Callable, Iterable
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Tuple
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileModifiedEvent, FileMovedEvent, FileDeletedEvent
 
 from db import Database  # 修改为绝对导入
+from config import DELETE_BATCH_WINDOW, DELETE_BATCH_MAX
+from filters import PathFilter
+import profiling
 
 class _Handler(FileSystemEventHandler):
-    def __init__(self, q: queue.Queue):
+    def __init__(self, q: queue.Queue, path_filter: Optional[PathFilter] = None):
         super().__init__()
         self.q = q
+        # 被排除的路径在入队前丢弃，不占用队列与工作线程
+        self.path_filter = path_filter
+
+    def _excluded(self, path: str) -> bool:
+        return self.path_filter is not None and not self.path_filter.include_path(path)
 
     def on_created(self, event):
-        if event.is_directory: return
+        if event.is_directory or self._excluded(event.src_path): return
         print(f"[WATCH] File created: {event.src_path}")
         self.q.put(("create", event.src_path))
 
     def on_modified(self, event):
-        if event.is_directory: return
+        if event.is_directory or self._excluded(event.src_path): return
         print(f"[WATCH] File modified: {event.src_path}")
         self.q.put(("modify", event.src_path))
 
     def on_moved(self, event: FileMovedEvent):
         if event.is_directory: return
+        if self._excluded(event.src_path):
+            # 源路径从未入库（如 *.!qB 下载完成后改名），目标被收录时按新建处理
+            if not self._excluded(event.dest_path):
+                print(f"[WATCH] File moved into scope: {event.src_path} -> {event.dest_path}")
+                self.q.put(("create", event.dest_path))
+            return
+        if self._excluded(event.dest_path):
+            # 移入被排除的位置，按删除源处理
+            print(f"[WATCH] File moved out of scope: {event.src_path} -> {event.dest_path}")
+            self.q.put(("delete", event.src_path))
+            return
         print(f"[WATCH] File moved: {event.src_path} -> {event.dest_path}")
         self.q.put(("move", event.src_path, event.dest_path))
 
     def on_deleted(self, event):
-        if event.is_directory: return
+        if event.is_directory or self._excluded(event.src_path): return
         print(f"[WATCH] File deleted: {event.src_path}")
         self.q.put(("delete", event.src_path))
 
-def start_watch(db: Database, roots_source: Iterable[str], roots_media: Iterable[str], categorize: Callable[[str], str]):
-    q: queue.Queue = queue.Queue()
-    handler = _Handler(q)
-    observer = Observer()
-    roots = set(list(roots_source) + list(roots_media))
-    
-    print(f"[WATCH] Setting up watchers for {len(roots)} directories")
-    for r in roots:
-        print(f"[WATCH] Adding watch for: {r}")
-        observer.schedule(handler, r, recursive=True)
+def process_event(db: Database, categorize: Callable[[str], str], item):
+    kind = item[0]
+    if kind in ("create", "modify"):
+        path = item[1]
+        with profiling.stage("categorize"):
+            cat = categorize(path)
+        if not cat:
+            return
+        with profiling.stage("isfile"):
+            is_file = os.path.isfile(path)
+        if is_file:
+            print(f"[WATCH] Processing {kind}: {path} ({cat})")
+            with profiling.stage("event.upsert"):
+                db.handle_create_or_modify(path, cat)
+    elif kind == "move":
+        src, dst = item[1], item[2]
+        with profiling.stage("categorize"):
+            dst_cat = categorize(dst)
+        with profiling.stage("isfile"):
+            is_file = os.path.exists(dst) and os.path.isfile(dst)
+        if dst_cat and is_file:
+            print(f"[WATCH] Processing move: {src} -> {dst} ({dst_cat})")
+            with profiling.stage("event.move"):
+                db.handle_move(src, dst, dst_cat)
+        else:
+            # 目标不在监控范围或目标已不存在，按删除源处理
+            print(f"[WATCH] Move target out of scope, treating as delete: {src}")
+            with profiling.stage("event.delete"):
+                db.handle_delete(src)
+    elif kind == "delete":
+        path = item[1]
+        print(f"[WATCH] Processing delete: {path}")
+        with profiling.stage("event.delete"):
+            db.handle_delete(path)
+
+_NO_ITEM = object()
+
+def _collect_deletes(q: queue.Queue, first, window: float, limit: int):
+    # 在 window 秒内继续收集连续的删除事件；遇到其它事件即停止，并把它交回给调用方
+    batch = [first]
+    deadline = time.monotonic() + window
+    while len(batch) < limit:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = q.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is not None and item[0] == "delete":
+            batch.append(item)
+            continue
+        return batch, item
+    return batch, _NO_ITEM
 
+def start_worker(db: Database, categorize: Callable[[str], str], q: queue.Queue) -> threading.Thread:
     def worker():
         print("[WATCH] Worker thread started")
+        carry = _NO_ITEM
         while True:
-            item = q.get()
+            if carry is _NO_ITEM:
+                with profiling.stage("queue.wait"):
+                    item = q.get()
+            else:
+                item, carry = carry, _NO_ITEM
             if item is None:  # stop signal
                 print("[WATCH] Worker thread stopping")
                 break
+            items = [item]
             try:
-                kind = item[0]
-                if kind in ("create", "modify"):
-                    path = item[1]
-                    cat = categorize(path)
-                    if not cat: 
-                        continue
-                    if os.path.isfile(path):
-                        print(f"[WATCH] Processing {kind}: {path} ({cat})")
-                        db.handle_create_or_modify(path, cat)
-                elif kind == "move":
-                    src, dst = item[1], item[2]
-                    dst_cat = categorize(dst)
-                    if dst_cat and os.path.exists(dst) and os.path.isfile(dst):
-                        print(f"[WATCH] Processing move: {src} -> {dst} ({dst_cat})")
-                        db.handle_move(src, dst, dst_cat)
-                    else:
-                        # 目标不在监控范围或目标已不存在，按删除源处理
-                        print(f"[WATCH] Move target out of scope, treating as delete: {src}")
-                        db.handle_delete(src)
-                elif kind == "delete":
-                    path = item[1]
-                    print(f"[WATCH] Processing delete: {path}")
-                    db.handle_delete(path)
+                if item[0] == "delete_batch":
+                    # 多 worker 模式下分发线程已合并好的删除批次
+                    paths = item[1]
+                    print(f"[WATCH] Processing delete batch: {len(paths)} files")
+                    with profiling.stage("event.delete"):
+                        db.handle_delete_batch(paths)
+                elif item[0] == "delete" and DELETE_BATCH_WINDOW > 0:
+                    # 整季删除等场景：合并短时间内的删除，批量解析硬链接与联动
+                    items, carry = _collect_deletes(q, item, DELETE_BATCH_WINDOW, DELETE_BATCH_MAX)
+                    paths = [i[1] for i in items]
+                    print(f"[WATCH] Processing delete: {paths[0]}" if len(paths) == 1
+                          else f"[WATCH] Processing delete batch: {len(paths)} files")
+                    with profiling.stage("event.delete"):
+                        db.handle_delete_batch(paths)
+                else:
+                    process_event(db, categorize, item)
             except Exception as e:
                 print(f"[WATCH] Error processing event {item}: {e}")
             finally:
-                q.task_done()
+                for _ in items:
+                    q.task_done()
 
     t = threading.Thread(target=worker, daemon=True)
     t.start()
+    return t
+
+class _WorkerQueue(queue.Queue):
+    """单个 worker 的子队列：条目附带完成回调，worker 每次 task_done() 按取出顺序回调。
+
+    每个子队列只有一个消费线程，取出顺序即完成顺序，因此 _collect_deletes 的批量
+    取出与逐条 task_done 都能对上。
+    """
+
+    def __init__(self, on_done: Callable):
+        super().__init__()
+        self.on_done = on_done
+        self._taken = deque()
+
+    def get(self, block=True, timeout=None):
+        entry = super().get(block, timeout)
+        if entry is None:
+            return None
+        token, item = entry
+        self._taken.append((token, item))
+        return item
+
+    def task_done(self):
+        super().task_done()
+        if self._taken:
+            self.on_done(*self._taken.popleft())
+
+
+def _route_paths(item) -> Tuple[str, ...]:
+    if item[0] == "delete_batch":
+        return tuple(item[1])
+    return (item[1], item[2]) if item[0] == "move" else (item[1],)
+
+
+def start_workers(db: Database, categorize: Callable[[str], str], q: queue.Queue, workers: int) -> threading.Thread:
+    """按路径哈希把事件分发到 workers 个 worker，同一路径的事件始终按序处理。
+
+    分发线程记录每个路径尚未完成的事件所在的 worker：路径有在途事件时，新事件
+    跟随到同一 worker，否则按哈希选择。move 涉及源与目标两个路径，若两者的在途
+    事件分属不同 worker，分发线程等待其中一方处理完再分发（仅连续改名时出现）。
+    删除窗口在分发线程中合并：整批作为一个 ("delete_batch", paths) 交给同一个 worker，
+    否则按哈希拆开后每个 worker 各自成批，qBittorrent 联动会按批重复登录与设置优先级。
+    返回分发线程：向 q 放入 None 后，它会停止所有 worker 并在它们退出后结束。
+    """
+    if workers <= 1:
+        return start_worker(db, categorize, q)
+
+    inflight: Dict[str, list] = {}   # path -> [worker, 在途事件数]
+    cond = threading.Condition()
+    # 带日志的队列需要按 seq 标记完成（各 worker 乱序完成），普通队列只计数
+    get_entry = getattr(q, "get_entry", None)
+
+    def on_done(token, item):
+        with cond:
+            for p in _route_paths(item):
+                slot = inflight.get(p)
+                if slot is not None:
+                    slot[1] -= 1
+                    if slot[1] <= 0:
+                        del inflight[p]
+            cond.notify()
+        # 删除批次的 token 是其中每个事件的 token 列表
+        for tok in (token if item[0] == "delete_batch" else (token,)):
+            if get_entry is not None:
+                q.done(tok)
+            else:
+                q.task_done()
+
+    subqueues = [_WorkerQueue(on_done) for _ in range(workers)]
+    threads = [start_worker(db, categorize, sq) for sq in subqueues]
+
+    def route(item) -> int:
+        paths = _route_paths(item)
+        with cond:
+            while True:
+                owners = {inflight[p][0] for p in paths if p in inflight}
+                if len(owners) <= 1:
+                    break
+                cond.wait()
+            idx = owners.pop() if owners else hash(paths[0]) % workers
+            for p in paths:
+                slot = inflight.get(p)
+                if slot is None:
+                    inflight[p] = [idx, 1]
+                else:
+                    slot[1] += 1
+        return idx
+
+    def next_entry(timeout=None):
+        if get_entry is not None:
+            entry = get_entry(timeout=timeout)
+            return entry if entry is not None else (None, None)
+        return None, q.get(timeout=timeout)
+
+    def collect_deletes(token, item):
+        # 与 _collect_deletes 相同的窗口规则，在路由前合并；遇到其它事件时交回调用方
+        tokens, paths = [token], [item[1]]
+        deadline = time.monotonic() + DELETE_BATCH_WINDOW
+        while len(paths) < DELETE_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                tok, nxt = next_entry(remaining)
+            except queue.Empty:
+                break
+            if nxt is None or nxt[0] != "delete":
+                return tokens, ("delete_batch", paths), (tok, nxt)
+            tokens.append(tok)
+            paths.append(nxt[1])
+        return tokens, ("delete_batch", paths), None
+
+    def dispatch():
+        print(f"[WATCH] Dispatcher started with {workers} workers")
+        carry = None
+        while True:
+            token, item = carry if carry is not None else next_entry()
+            carry = None
+            if item is None:
+                break
+            if item[0] == "delete" and DELETE_BATCH_WINDOW > 0:
+                token, item, carry = collect_deletes(token, item)
+            subqueues[route(item)].put((token, item))
+        for sq in subqueues:
+            sq.put(None)
+        for t in threads:
+            t.join(timeout=5)
+        print("[WATCH] Dispatcher stopped")
+
+    t = threading.Thread(target=dispatch, name="dispatcher", daemon=True)
+    t.start()
+    return t
+
+def start_watch(db: Database, roots_source: Iterable[str], roots_media: Iterable[str], categorize: Callable[[str], str],
+                path_filter: Optional[PathFilter] = None, q: Optional[queue.Queue] = None, workers: int = 1):
+    # q 可由调用方传入（如带预写日志、已放入待重放事件的 JournaledQueue）
+    if q is None:
+        q = queue.Queue()
+    handler = _Handler(q, path_filter)
+    observer = Observer()
+    roots = set(list(roots_source) + list(roots_media))
+    
+    print(f"[WATCH] Setting up watchers for {len(roots)} directories")
+    for r in roots:
+        print(f"[WATCH] Adding watch for: {r}")
+        observer.schedule(handler, r, recursive=True)
+
+    t = start_workers(db, categorize, q, workers)
     observer.start()
     print("[WATCH] Observer started")
     return observer, q, t
\ No newline at end of file
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+
+class _FakeServer:
+    """在本地随机端口运行的替身 HTTP 服务，每个请求前注入 latency 秒延迟。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.by_path: Dict[str, int] = {}  # 按 API 路径计数
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                with owner._lock:
+                    owner.requests += 1
+                    owner.by_path[url.path] = owner.by_path.get(url.path, 0) + 1
+                if owner.latency:
+                    time.sleep(owner.latency)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                status, payload = owner.route(method, url.path, parse_qs(url.query), parse_qs(body))
+                data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def route(self, method, path, query, form):
+        return 404, {}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeQBittorrent(_FakeServer):
+    """qBittorrent WebUI API 替身：每个种子对应一组源文件。"""
+
+    def __init__(self, torrents: List[List[str]], latency: float = 0.0):
+        super().__init__(latency)
+        self.torrents: Dict[str, List[dict]] = {}
+        for i, files in enumerate(torrents):
+            h = f"{i:040x}"
+            self.torrents[h] = [
+                {"name": os.path.join(os.path.basename(os.path.dirname(p)), os.path.basename(p)), "priority": 1}
+                for p in files
+            ]
+
+    def route(self, method, path, query, form):
+        if path == "/api/v2/auth/login":
+            return 200, "Ok."
+        if path == "/api/v2/auth/logout":
+            return 200, ""
+        if path == "/api/v2/torrents/info":
+            return 200, [{"hash": h, "name": h, "category": ""} for h in self.torrents]
+        if path == "/api/v2/torrents/files":
+            return 200, self.torrents.get(query.get("hash", [""])[0], [])
+        if path == "/api/v2/torrents/filePrio":
+            files = self.torrents.get(form.get("hash", [""])[0], [])
+            prio = int(form.get("priority", ["0"])[0])
+            for idx in form.get("id", [""])[0].split("|"):
+                if idx.isdigit() and int(idx) < len(files):
+                    files[int(idx)]["priority"] = prio
+            return 200, ""
+        if path == "/api/v2/torrents/delete":
+            for h in form.get("hashes", [""])[0].split("|"):
+                self.torrents.pop(h, None)
+            return 200, ""
+        return 404, {}
+
+
+class FakeMoviePilot(_FakeServer):
+    """MoviePilot API 替身：任何标题都返回一条严格匹配的整理记录。"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self._next_id = 0
+
+    def route(self, method, path, query, form):
+        if path == "/api/v1/login/access-token":
+            return 200, {"access_token": "bench-token", "expires_in": 3600}
+        if path == "/api/v1/user/admin":
+            return 200, {}
+        if path == "/api/v1/history/transfer":
+            if method == "GET":
+                self._next_id += 1
+                title = query.get("title", [""])[0]
+                return 200, {"success": True, "data": {
+                    "list": [{"id": self._next_id, "dest_fileitem": {"name": title}}], "total": 1}}
+            return 200, {"success": True}
+        return 404, {}
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""可复现的性能基准：扫描、事件风暴与删除级联。
+
+用法：
+    python bench/run_bench.py --files 5000 --out bench_results.json
+    python bench/run_bench.py --scenario delete --qb-latency 0.02 --compare old.json
+
+每个场景都在独立的临时目录与数据库中运行，结果（files/sec、events/sec、
+p50/p99 延迟）写入 JSON 文件，--compare 可与之前的结果对比。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "app"))
+sys.path.insert(0, BENCH_DIR)
+
+from treegen import make_tree  # noqa: E402
+from fake_services import FakeQBittorrent, FakeMoviePilot  # noqa: E402
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(pct / 100.0 * (len(s) - 1))))]
+
+
+def latency_summary(samples_s: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(samples_s, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples_s, 99) * 1000, 3),
+        "max_ms": round(max(samples_s) * 1000, 3) if samples_s else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    # 业务代码大量 print，基准默认丢弃输出以免终端 I/O 干扰计时
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class TimedQueue(queue.Queue):
+    """记录每个事件从入队到 task_done 的耗时，支持多个消费线程。"""
+
+    def __init__(self):
+        super().__init__()
+        self.latencies: List[float] = []
+        self._current = threading.local()
+        self._lat_lock = threading.Lock()
+
+    def put(self, item, block=True, timeout=None):
+        super().put((time.perf_counter(), item), block, timeout)
+
+    def get(self, block=True, timeout=None):
+        enq, item = super().get(block, timeout)
+        self._current.enq = enq
+        return item
+
+    def task_done(self):
+        enq = getattr(self._current, "enq", None)
+        if enq is not None:
+            with self._lat_lock:
+                self.latencies.append(time.perf_counter() - enq)
+            self._current.enq = None
+        super().task_done()
+
+    # 与 JournaledQueue 相同的接口：多 worker 分发时由分发线程取出、worker 乱序完成
+    def get_entry(self, block=True, timeout=None):
+        return super().get(block, timeout)
+
+    def done(self, enq: float):
+        with self._lat_lock:
+            self.latencies.append(time.perf_counter() - enq)
+        super().task_done()
+
+
+def _empty_db(workdir: str):
+    from db import Database
+    from integrations import IntegrationRegistry
+    return Database(os.path.join(workdir, "bench.db"), IntegrationRegistry())
+
+
+def _categorizer(tree):
+    from main import make_categorizer
+    return make_categorizer([tree.source_dir], [tree.media_dir])
+
+
+# ---------------- 场景 ----------------
+def bench_scan(args, workdir: str) -> Dict:
+    from filters import build_filter
+    from iothrottle import build_scheduler
+    from scanner import full_refresh
+    tree = make_tree(workdir, args.files, args.hardlink_ratio, args.files_per_torrent)
+    db = _empty_db(workdir)
+    # 与生产一致：使用 config 中的默认过滤规则
+    path_filter = build_filter()
+    categorize = _categorizer(tree)
+    rows = len(tree.source_files) + len(tree.media_files)
+    runs = []
+    wal = []
+    page_size = db.conn.execute("PRAGMA page_size").fetchone()[0]
+    for _ in range(args.repeat):
+        with quiet(args.quiet):
+            # 清空 WAL 后扫描，再用被动检查点读出本轮写入的帧数
+            db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            t0 = time.perf_counter()
+            full_refresh(db, [tree.source_dir], [tree.media_dir], categorize, path_filter, build_scheduler())
+            runs.append(time.perf_counter() - t0)
+            frames = db.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()[1]
+            wal.append(frames * (page_size + 24))
+    # 第一轮写入全部记录；之后各轮是对未变化目录的重扫
+    best = min(runs)
+    return {"files": rows, "seconds": round(best, 4), "files_per_sec": round(rows / best, 1),
+            "first_run_s": round(runs[0], 4),
+            "first_run_wal_mb": round(wal[0] / 2**20, 2), "rescan_wal_mb": round(wal[-1] / 2**20, 2),
+            "skipped_pct": db.upsert_stats()["skipped_pct"], "runs_s": [round(r, 4) for r in runs]}
+
+
+def make_storm(tree, events: int, seed: int = 7) -> List[tuple]:
+    """构造事件风暴：以 modify 为主，混合 create / move / delete。"""
+    rng = random.Random(seed)
+    files = list(tree.source_files)
+    out = []
+    for i in range(events):
+        r = rng.random()
+        if r < 0.70:
+            out.append(("modify", rng.choice(files)))
+        elif r < 0.85:
+            p = os.path.join(tree.source_dir, f"storm-{i}.tmp")
+            open(p, "wb").close()
+            out.append(("create", p))
+        elif r < 0.95:
+            src = rng.choice(files)
+            dst = src + ".moved"
+            if os.path.exists(src):
+                os.rename(src, dst)
+                files.remove(src)
+                files.append(dst)
+                out.append(("move", src, dst))
+        else:
+            # 只删除 DB 记录路径（不删文件），测纯粹的事件处理开销
+            out.append(("delete", os.path.join(tree.source_dir, f"missing-{i}")))
+    return out
+
+
+def replay_storm(db, categorize, storm: List[tuple], workers: int = 1) -> Dict:
+    """把事件一次性灌入 watcher 的 worker 池（按路径哈希分发），返回吞吐与延迟。"""
+    from watcher import start_workers
+    q = TimedQueue()
+    t = start_workers(db, categorize, q, workers)
+    t0 = time.perf_counter()
+    for item in storm:
+        q.put(item)
+    q.join()
+    elapsed = time.perf_counter() - t0
+    q.put(None)
+    t.join(timeout=10)
+    return {"events": len(storm), "seconds": round(elapsed, 4),
+            "events_per_sec": round(len(storm) / elapsed, 1), **latency_summary(q.latencies)}
+
+
+def bench_events(args, workdir: str) -> Dict:
+    from scanner import full_refresh
+    tree = make_tree(workdir, args.files, args.hardlink_ratio, args.files_per_torrent)
+    db = _empty_db(workdir)
+    categorize = _categorizer(tree)
+    with quiet(args.quiet):
+        full_refresh(db, [tree.source_dir], [tree.media_dir], categorize)
+        storm = make_storm(tree, args.events)
+        return replay_storm(db, categorize, storm)
+
+
+def _point_services(workdir: str, fqb, fmp):
+    import qb
+    import moviepilot
+    qb.QB_URL = fqb.url
+    moviepilot.TOKEN_FILE = os.path.join(workdir, "token.json")
+    moviepilot.LOGIN_URL = f"{fmp.url}/api/v1/login/access-token"
+    moviepilot.USER_INFO_URL = f"{fmp.url}/api/v1/user/admin"
+    for name in ("QUERY_BASE_URL", "QUERY_DETAIL_URL", "DELETE_TRANSFER_URL"):
+        setattr(moviepilot, name, f"{fmp.url}/api/v1/history/transfer")
+
+
+# 各场景未显式指定时的 (delete_files, qb_latency, mp_latency)：
+# workers 场景需要外部服务有延迟，worker 并发才有意义
+_SCENARIO_DEFAULTS = {
+    "delete": (200, 0.0, 0.0),
+    "workers": (60, 0.02, 0.02),
+}
+
+
+def _scenario_opts(args, scenario: str) -> Tuple[int, float, float]:
+    defaults = _SCENARIO_DEFAULTS[scenario]
+    given = (args.delete_files, args.qb_latency, args.mp_latency)
+    return tuple(d if v is None else v for v, d in zip(given, defaults))
+
+
+def bench_delete(args, workdir: str) -> Dict:
+    from db import Database
+    from integrations import IntegrationRegistry, MoviePilotIntegration, QBittorrentIntegration
+    from config import INTEGRATIONS
+    from scanner import full_refresh
+
+    delete_files, qb_latency, mp_latency = _scenario_opts(args, "delete")
+    files = min(args.files, delete_files)
+    tree = make_tree(workdir, files, 1.0, args.files_per_torrent)
+    with FakeQBittorrent(tree.torrents, qb_latency) as fqb, FakeMoviePilot(mp_latency) as fmp:
+        # 指向替身服务
+        _point_services(workdir, fqb, fmp)
+
+        registry = IntegrationRegistry()
+        with quiet(args.quiet):
+            registry.register(MoviePilotIntegration(**INTEGRATIONS.get("moviepilot", {})))
+            registry.register(QBittorrentIntegration(**INTEGRATIONS.get("qbittorrent", {})))
+            db = Database(os.path.join(workdir, "bench.db"), registry)
+            full_refresh(db, [tree.source_dir], [tree.media_dir], _categorizer(tree))
+
+        # 随机删除顺序，避免匹配总落在种子列表开头
+        victims = list(tree.media_files)
+        random.Random(11).shuffle(victims)
+        latencies = []
+        t0 = time.perf_counter()
+        with quiet(args.quiet):
+            step = max(1, args.delete_batch)
+            for i in range(0, len(victims), step):
+                chunk = victims[i:i + step]
+                s = time.perf_counter()
+                for mpath in chunk:
+                    os.remove(mpath)
+                db.handle_delete_batch(chunk)
+                # 批内每个文件的延迟都按整批完成计
+                latencies.extend([time.perf_counter() - s] * len(chunk))
+            registry.shutdown(wait=True)
+        elapsed = time.perf_counter() - t0
+        return {"deletes": len(tree.media_files), "batch": step, "seconds": round(elapsed, 4),
+                "deletes_per_sec": round(len(tree.media_files) / elapsed, 2),
+                "qb_requests": fqb.requests, "mp_requests": fmp.requests,
+                **latency_summary(latencies)}
+
+
+def _delete_burst(db, categorize, media_files: List[str], workers: int, fqb) -> Dict:
+    """整季删除：同一季目录下的媒体文件一次性删除，统计删除批次数与 qBittorrent 请求数。
+
+    无论 worker 数多少，都应合并为一个 handle_delete_batch，每个种子只调用一次 filePrio。
+    """
+    by_dir: Dict[str, List[str]] = {}
+    for m in media_files:
+        if os.path.exists(m):
+            by_dir.setdefault(os.path.dirname(m), []).append(m)
+    if not by_dir:
+        return {}
+    paths = max(by_dir.values(), key=len)
+    batches: List[int] = []
+    orig = db.handle_delete_batch
+
+    def counting(ps):
+        batches.append(len(ps))
+        return orig(ps)
+
+    db.handle_delete_batch = counting
+    before = dict(fqb.by_path)
+    try:
+        for p in paths:
+            os.remove(p)
+        replay_storm(db, categorize, [("delete", p) for p in paths], workers)
+    finally:
+        del db.handle_delete_batch
+    delta = {k: v - before.get(k, 0) for k, v in fqb.by_path.items()}
+    return {"burst_deletes": len(paths), "burst_batches": batches,
+            "burst_qb_requests": sum(delta.values()),
+            "burst_qb_logins": delta.get("/api/v2/auth/login", 0),
+            "burst_qb_fileprio": delta.get("/api/v2/torrents/filePrio", 0)}
+
+
+def bench_workers(args, workdir: str) -> Dict:
+    """worker 池扩展性：删除级联（同步调用替身 qBittorrent/MoviePilot）混在 modify/create 中，
+    对比不同 worker 数的吞吐与非删除事件的延迟。"""
+    from db import Database
+    from integrations import IntegrationRegistry, MoviePilotIntegration, QBittorrentIntegration
+    from config import INTEGRATIONS
+    from scanner import full_refresh
+
+    delete_files, qb_latency, mp_latency = _scenario_opts(args, "workers")
+    out = {}
+    for workers in args.workers:
+        run_dir = os.path.join(workdir, f"w{workers}")
+        os.makedirs(run_dir)
+        tree = make_tree(run_dir, min(args.files, delete_files * 5), 1.0, args.files_per_torrent)
+        rng = random.Random(5)
+        victims = list(tree.media_files)
+        rng.shuffle(victims)
+        victims = victims[:delete_files]
+        others = [p for p in tree.source_files if os.path.basename(p) not in {os.path.basename(v) for v in victims}]
+        with FakeQBittorrent(tree.torrents, qb_latency) as fqb, FakeMoviePilot(mp_latency) as fmp:
+            _point_services(run_dir, fqb, fmp)
+            registry = IntegrationRegistry()
+            with quiet(args.quiet):
+                # 插件线程池与 worker 数一致，否则同步调用会在插件内部串行
+                for cls in (MoviePilotIntegration, QBittorrentIntegration):
+                    kw = dict(INTEGRATIONS.get(cls.name, {}), mode="sync")
+                    kw["concurrency"] = max(workers, kw.get("concurrency", 1))
+                    registry.register(cls(**kw))
+                db = Database(os.path.join(run_dir, "bench.db"), registry)
+                categorize = _categorizer(tree)
+                full_refresh(db, [tree.source_dir], [tree.media_dir], categorize)
+                storm = []
+                for v in victims:
+                    os.remove(v)
+                    storm.append(("delete", v))
+                    storm.extend(("modify", rng.choice(others)) for _ in range(9))
+                res = replay_storm(db, categorize, storm, workers)
+                burst = _delete_burst(db, categorize, tree.media_files, workers, fqb)
+                registry.shutdown(wait=True)
+        res["qb_requests"] = fqb.requests
+        out[f"w{workers}_events_per_sec"] = res["events_per_sec"]
+        out[f"w{workers}_p50_ms"] = res["p50_ms"]
+        out[f"w{workers}_p99_ms"] = res["p99_ms"]
+        for k, v in burst.items():
+            out[f"w{workers}_{k}"] = v
+        print(f"[BENCH]   workers={workers}: {res}")
+        print(f"[BENCH]   workers={workers} season delete: {burst}")
+    return out
+
+
+def bench_memindex(args, workdir: str) -> Dict:
+    """内存索引：批量加载耗时、每文件内存、路径/硬链接查询速率（对比 SQLite）。"""
+    import tracemalloc
+    from memindex import PathIndex
+
+    db = _empty_db(workdir)
+    n = args.index_rows
+    rows = []
+    for i in range(n // 2):
+        t, e = divmod(i, args.files_per_torrent)
+        name = f"Show.{t:06d}.S01E{e + 1:02d}.1080p.WEB-DL.x264.mkv"
+        rows.append((f"/mnt/disk{t % 12}/source/Show.{t:06d}.S01.1080p/{name}", "source", 2049, 10_000_000 + i,
+                     1_500_000_000 + i, 1_700_000_000.0 + i))
+        rows.append((f"/mnt/disk{t % 12}/media/Show {t:06d}/Season 01/{name}", "media", 2049, 10_000_000 + i,
+                     1_500_000_000 + i, 1_700_000_000.0 + i))
+    with db.tx():
+        db.upsert_rows(rows)
+    paths = [r[0] for r in rows]
+    del rows
+
+    index = PathIndex()
+    t0 = time.perf_counter()
+    index.load(db.conn)
+    load_s = time.perf_counter() - t0
+    # 内存单独测一次：tracemalloc 会显著拖慢加载
+    index.clear()
+    tracemalloc.start()
+    index.load(db.conn)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rng = random.Random(3)
+    sample = [rng.choice(paths) for _ in range(min(50000, len(paths)))]
+    t0 = time.perf_counter()
+    for p in sample:
+        rec = index.get(p)
+        index.siblings(rec.dev, rec.ino, "source")
+    mem_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for p in sample:
+        row = db.get_by_path(p)
+        db.get_by_devino(row["dev"], row["ino"], "source")
+    sql_s = time.perf_counter() - t0
+
+    return {"files": len(index), "load_seconds": round(load_s, 3),
+            "load_files_per_sec": round(len(index) / load_s, 1),
+            "bytes_per_file": round(mem / len(index), 1), "total_mb": round(mem / 2**20, 1),
+            "lookups_per_sec_memory": round(len(sample) / mem_s, 1),
+            "lookups_per_sec_sqlite": round(len(sample) / sql_s, 1)}
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "scan": bench_scan,
+    "events": bench_events,
+    "delete": bench_delete,
+    "memindex": bench_memindex,
+    "workers": bench_workers,
+}
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old: Dict, new: Dict):
+    print("\n=== Compared with previous run ===")
+    for name, res in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if not prev:
+            continue
+        for key, val in res.items():
+            if not isinstance(val, (int, float)) or key not in prev or not prev[key]:
+                continue
+            delta = (val - prev[key]) / prev[key] * 100
+            print(f"{name:>8}.{key:<16} {prev[key]:>12} -> {val:<12} ({delta:+.1f}%)")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Benchmarks for scan, event and delete-cascade paths.")
+    ap.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run (repeatable, default: all)")
+    ap.add_argument("--files", type=int, default=5000, help="Source files in the synthetic tree")
+    ap.add_argument("--hardlink-ratio", type=float, default=0.8, help="Fraction of source files hardlinked into media")
+    ap.add_argument("--files-per-torrent", type=int, default=10, help="Source files per fake torrent")
+    ap.add_argument("--events", type=int, default=20000, help="Events in the replayed storm")
+    ap.add_argument("--delete-files", type=int, help="Max media files deleted (default: 200 for delete, 60 for workers)")
+    ap.add_argument("--delete-batch", type=int, default=1, help="Media files per handle_delete_batch call (1 = one at a time)")
+    ap.add_argument("--workers", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8],
+                    help="Worker counts compared in the workers scenario (comma-separated)")
+    ap.add_argument("--index-rows", type=int, default=200000, help="Rows loaded in the memindex scenario")
+    ap.add_argument("--qb-latency", type=float, help="Injected latency per qBittorrent request in s (default: 0 for delete, 0.02 for workers)")
+    ap.add_argument("--mp-latency", type=float, help="Injected latency per MoviePilot request in s (default: 0 for delete, 0.02 for workers)")
+    ap.add_argument("--repeat", type=int, default=3, help="Repetitions for the scan scenario (best is reported)")
+    ap.add_argument("--out", default="bench_results.json", help="JSON results file")
+    ap.add_argument("--compare", help="Previous JSON results to compare against")
+    ap.add_argument("--verbose", dest="quiet", action="store_false", help="Show application output")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "scenario")},
+        },
+        "results": {},
+    }
+    for name in scenarios:
+        print(f"[BENCH] Running {name}...")
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+            res = SCENARIOS[name](args, workdir)
+        report["results"][name] = res
+        print(f"[BENCH] {name}: {json.dumps(res)}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import random
+from typing import List, NamedTuple
+
+
+class Tree(NamedTuple):
+    source_dir: str
+    media_dir: str
+    source_files: List[str]
+    media_files: List[str]        # 与 source 硬链接的媒体文件
+    torrents: List[List[str]]     # 每个种子目录下的源文件，用于构造假 qBittorrent
+
+
+def make_tree(root: str, files: int = 1000, hardlink_ratio: float = 0.8,
+              files_per_torrent: int = 10, file_size: int = 0, seed: int = 42) -> Tree:
+    """在 root 下生成合成的 source/media 目录树。
+
+    source/<torrent>/<name>.mkv 为源文件，按 files_per_torrent 分组模拟种子；
+    其中 hardlink_ratio 比例的文件在 media/<show>/Season 01/ 下建立硬链接。
+    file_size 为每个文件写入的字节数（0 表示空文件，只测元数据路径）。
+    """
+    rng = random.Random(seed)
+    source_dir = os.path.join(root, "source")
+    media_dir = os.path.join(root, "media")
+    os.makedirs(source_dir, exist_ok=True)
+    os.makedirs(media_dir, exist_ok=True)
+
+    payload = b"\0" * file_size
+    source_files: List[str] = []
+    media_files: List[str] = []
+    torrents: List[List[str]] = []
+
+    for i in range(files):
+        t = i // files_per_torrent
+        if t == len(torrents):
+            torrents.append([])
+            os.makedirs(os.path.join(source_dir, f"Show.{t:05d}.S01.1080p"), exist_ok=True)
+        name = f"Show.{t:05d}.S01E{i % files_per_torrent + 1:02d}.1080p.mkv"
+        spath = os.path.join(source_dir, f"Show.{t:05d}.S01.1080p", name)
+        with open(spath, "wb") as f:
+            f.write(payload)
+        source_files.append(spath)
+        torrents[t].append(spath)
+
+        if rng.random() < hardlink_ratio:
+            mdir = os.path.join(media_dir, f"Show {t:05d}", "Season 01")
+            os.makedirs(mdir, exist_ok=True)
+            mpath = os.path.join(mdir, name)
+            os.link(spath, mpath)
+            media_files.append(mpath)
+
+    return Tree(source_dir, media_dir, source_files, media_files, torrents)